@@ -1,7 +1,8 @@
 """The client side for Go Pie."""
 
 # Third party library imports.
-from podsixnet2.Connection import connection, ConnectionListener
+from podsixnet2.Connection import ConnectionListener
+from podsixnet2.Loopback import LoopbackEndPoint
 
 # Local library imports.
 from config import *
@@ -10,10 +11,26 @@ import pydeck as pd
 
 class PieClient(ConnectionListener):
     """The client for the PieServer."""
-    def __init__(self, scene, address=(DEFAULT_HOST, DEFAULT_PORT)):
-        """Create new instance of a client and connect to the given server address."""
+    # A full hand and stats snapshot makes any earlier one, and the changes received before it, pointless to apply.
+    supersedes = {"hand_and_stats": ("hand_and_stats", "hand_and_stats_delta")}
+
+    def __init__(self, scene, address=(DEFAULT_HOST, DEFAULT_PORT), players=None, server=None):
+        """Create new instance of a client and connect to the given server address.
+
+        If players is given, ask the server for a table of that many players instead of its default.
+        If server is given, connect to that server in this process directly instead of over the network."""
         # The game scene.
         self.scene = scene
+        # The table size to ask for.
+        self.players = players
+        if server:
+            # Talk to the server hosted by this process through memory.
+            self.connection = LoopbackEndPoint(server)
+        else:
+            # Tune the socket as configured.
+            self.connection.sendbuffer = SEND_BUFFER
+            self.connection.recvbuffer = RECEIVE_BUFFER
+            self.connection.keepalive = KEEPALIVE
         # Connect to the server address.
         self.Connect(address)
         # The client address is unknown until sent by the server.
@@ -33,11 +50,11 @@ class PieClient(ConnectionListener):
         If the server has yet to confirm a valid connection, returns None."""
         return f"{self.address[0]}:{self.address[1]}" if self.address else None
 
-    def pump(self):
-        """Pump the network classes.
+    def pump(self, timeout=0.0):
+        """Pump the network classes, waiting up to timeout seconds for network activity.
 
         Should be called once per game loop."""
-        connection.Pump()
+        self.connection.Pump(timeout)
         self.Pump()
 
     def Network_connected(self, data):
@@ -59,6 +76,16 @@ class PieClient(ConnectionListener):
         print(f"[Client] Confirmed address {self.get_address()}")
         # Update client status.
         self.scene.update_client_status("Waiting for players")
+        # Join the matchmaking queue for the table size wanted.
+        if self.players:
+            self.Send({"action": "join", "players": self.players})
+
+    def Network_queue(self, data):
+        """The matchmaking queue has changed."""
+        status = f"Waiting for players {data['waiting']}/{data['players']}"
+        if data["wait"]:
+            status += f", about {data['wait']:.0f}s"
+        self.scene.update_client_status(status)
 
     def Network_chat(self, data):
         """Simply prints chat data to stdout."""
@@ -84,8 +111,23 @@ class PieClient(ConnectionListener):
         self.hand = pd.Stack(data["hand"])
         self.hand.sort()
         self.stats = data["stats"]
+        self.update_hand_and_stats(data["deck"])
+
+    def Network_hand_and_stats_delta(self, data):
+        """Applies the changes to the player's hand and stats since the last update."""
+        if removed := set(data.get("removed", ())):
+            self.hand.cards = [card for card in self.hand.cards if str(card) not in removed]
+        if added := data.get("added"):
+            self.hand.add_list(pd.Card(card) for card in added)
+            self.hand.sort()
+        for player_id, stat in data["stats"].items():
+            self.stats[player_id] = stat
+        self.update_hand_and_stats(data["deck"])
+
+    def update_hand_and_stats(self, deck):
+        """Shows the player's hand and stats in the scene."""
         # Update client deck status.
-        self.scene.update_deck_status(f"Deck: {data['deck']} cards")
+        self.scene.update_deck_status(f"Deck: {deck} cards")
         # Update client stats.
         self.scene.update_stats(self.stats)
         # Update client cards.
@@ -123,7 +165,7 @@ class PieClient(ConnectionListener):
     def quit(self):
         """Quit the client and exit the server.
         If the connection has been closed, this has no effect."""
-        if connection.connected:
+        if self.connection.connected:
             print("[Client] Client shut down.")
             # Close connection to the server.
-            connection.close()
+            self.connection.close()
@@ -11,6 +11,16 @@ __all__ = [
     "DEFAULT_HOST",
     "DEFAULT_PORT",
     "PUBLIC_SERVER",
+    "MAX_FPS",
+    "DEFAULT_PLAYERS",
+    "LISTEN_BACKLOG",
+    "SEND_BUFFER",
+    "RECEIVE_BUFFER",
+    "KEEPALIVE",
+    "REUSE_PORT",
+    "COMPRESS",
+    "COMPRESS_THRESHOLD",
+    "HOSTED_SERVER",
 ]
 
 # Try to load in the config file.
@@ -33,3 +43,23 @@ DEFAULT_HOST = config_data.get("default_host", "127.0.0.1")
 DEFAULT_PORT = config_data.get("default_port", 5071)
 # Whether the server is public with ngrok or not.
 PUBLIC_SERVER = config_data.get("public_server", False)
+# The number of players at each table of a dedicated server.
+DEFAULT_PLAYERS = config_data.get("default_players", 2)
+# The frame rate cap, the time left over each frame is spent waiting on the network. Null or 0 leaves it uncapped.
+MAX_FPS = config_data.get("max_fps", 60) or 0
+# The most connections a server lets wait to be accepted, so a rush of players isn't turned away.
+LISTEN_BACKLOG = config_data.get("listen_backlog", 128)
+# The socket send and receive buffer sizes in bytes, None keeps the system defaults.
+SEND_BUFFER = config_data.get("send_buffer", None)
+RECEIVE_BUFFER = config_data.get("receive_buffer", None)
+# The seconds a connection sits idle before keepalive probes check the other end is still there, None for no probes.
+KEEPALIVE = config_data.get("keepalive", 60)
+# Whether other processes may listen on the server port too.
+REUSE_PORT = config_data.get("reuse_port", False)
+# Whether the server offers to deflate the messages it sends, and the smallest message in bytes worth deflating.
+# Each client has its own deflate stream, so a broadcast is compressed once per player rather than encoded once.
+COMPRESS = config_data.get("compress", False)
+COMPRESS_THRESHOLD = config_data.get("compress_threshold", 256)
+# Where the game runs the server it hosts, "inline" to pump it between frames,
+# or "thread" or "process" to keep it running at full speed whatever the frame rate.
+HOSTED_SERVER = config_data.get("hosted_server", "inline")
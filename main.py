@@ -4,6 +4,7 @@
 # Standard library imports.
 import sys
 import random
+import time
 
 # Third party library imports.
 import pygame as pg
@@ -27,6 +28,8 @@ class Main:
         self.clock = pg.time.Clock()
         # The time that passed between the last two frames in milliseconds.
         self.dt = 0
+        # When the next frame is due, in seconds by time.perf_counter().
+        self.next_frame = 0
 
         # Convert the card images.
         for card_rank, card_image in card_images.items():
@@ -60,9 +63,13 @@ class Main:
         sys.exit()
 
     def pump(self):
-        """Tick the clock and pump network classes."""
-        # Tick clock once per game loop for dt and fps.
-        self.dt = self.clock.tick()
+        """Pump network classes until the next frame is due, then tick the clock."""
+        # Wait on the network in the current scene for what is left of this frame.
+        self.scene.pump(max(0.0, self.next_frame - time.perf_counter()))
+        # Tick clock once per game loop for dt and fps, sleeping out the frame if the scene didn't wait.
+        self.dt = self.clock.tick(MAX_FPS)
+        # An uncapped frame rate leaves no time over, so the network is only polled.
+        self.next_frame = time.perf_counter() + (1 / MAX_FPS if MAX_FPS > 0 else 0)
         # Switch scenes.
         if scene := self.scene.next_scene:
             if scene == NextScene.QUIT:
@@ -75,8 +82,6 @@ class Main:
                 self.scene = JoinScene(self.screen_rect)
             elif scene == NextScene.GAME:
                 self.scene = GameScene(self.screen_rect, **self.scene.kwargs)
-        # Pump the network classes in the current scene.
-        self.scene.pump()
 
     def events(self):
         """Handle pygame events."""
@@ -0,0 +1,561 @@
+"""
+The message handling shared by every transport: framing, decoding and dispatching incoming messages, and queueing outgoing ones.
+
+These classes don't touch sockets. Channel, Server and EndPoint add them to asyncore, and the classes in podsixnet2.aio add them to asyncio.
+A channel's transport provides _Push(data) to write bytes, _WritingBytes() for how many bytes are still being written, _Cork(corked),
+handle_close() to disconnect, and a connected flag.
+"""
+
+from __future__ import print_function
+import struct
+import heapq
+import itertools
+import zlib
+from time import monotonic
+
+from podsixnet2.rencode import Encoder, Decoder
+
+def handles(*actions):
+    """Decorator registering a method as the handler for each of the given actions, besides any action in its Network_ name."""
+    def register(method):
+        method.actions = getattr(method, "actions", ()) + actions
+        return method
+    return register
+
+# dispatch table of each class, built the first time one of its instances receives a message
+_tables = {}
+
+def DispatchTable(cls):
+    """Returns a dict from each action cls handles to the functions which handle it, and the functions for any other action.
+    Handlers are the Network_<action> methods and those registered with @handles, followed by the catch-all Network method.
+    Actions with no handler of their own go to Network and then to UnknownAction, if the class has them."""
+    if cls in _tables:
+        return _tables[cls]
+    catchall = (cls.Network,) if hasattr(cls, "Network") else ()
+    table = {}
+    for name in dir(cls):
+        method = getattr(cls, name, None)
+        if not callable(method):
+            continue
+        actions = getattr(method, "actions", ())
+        if name.startswith("Network_"):
+            actions = (name[len("Network_"):],) + actions
+        for action in actions:
+            table[action] = table.get(action, ()) + (method,)
+    for action in table:
+        table[action] += catchall
+    unknown = catchall + ((cls.UnknownAction,) if hasattr(cls, "UnknownAction") else ())
+    _tables[cls] = table, unknown
+    return table, unknown
+
+def Dispatch(handler, data):
+    """Calls handler's methods for the action of the message data, looked up in its class's dispatch table."""
+    table, unknown = _tables.get(type(handler)) or DispatchTable(type(handler))
+    for method in table.get(data["action"], unknown):
+        method(handler, data)
+
+class ChannelBase(object):
+    endchars = '\0---\0'
+    # framing modes this channel can use besides the endchars terminator, in order of preference
+    framings = ("length",)
+    # header carrying the size of each message in "length" framing, with the top bit set for compressed messages
+    lengthheader = struct.Struct("!I")
+    compressedflag = 1 << 31
+    # bytes preallocated for receiving, the buffer only grows for messages larger than this
+    recvbuffersize = 65536
+    # largest message accepted, anything bigger is treated as an error
+    maxmessagesize = 1 << 20
+    # whether to cork the socket while each pump is written
+    cork = False
+    # bytes of pending output at which the channel becomes congested, and of output queued or being written at which it recovers
+    highwater = 1 << 20
+    lowwater = 1 << 18
+    # what a congested channel does besides replacing superseded messages: "drop" non-critical messages,
+    # "pause" them until it recovers, or "disconnect"
+    backpressure = "drop"
+    # actions whose newest message makes any older one still queued pointless, such as state snapshots
+    superseded = ()
+    # the actions whose queued messages each superseded action replaces, if not just its own, such as changes since an older snapshot
+    supersedes = {}
+    # actions which can be dropped or held back while congested, such as chat
+    noncritical = ()
+    # bytes of pending output at which the channel is closed whatever the policy
+    maxpending = 1 << 23
+    # strings such as action names and keys which the server offers in its greeting to send as two byte codes,
+    # clients that accept the offer use them both ways
+    symbols = ()
+    # whether the server offers to compress messages of at least compressthreshold bytes with zlib, clients accept
+    # the offer when they use "length" framing
+    compress = False
+    compressthreshold = 256
+    # socket send and receive buffer sizes in bytes, and seconds idle before keepalive probes, None keeps the system default
+    sendbuffer = None
+    recvbuffer = None
+    keepalive = None
+    
+    def __init__(self):
+        self._terminator = self.endchars.encode()
+        # incoming bytes are received straight into this buffer, and complete messages are decoded from it in place
+        self._rbuffer = bytearray(self.recvbuffersize)
+        self._rview = memoryview(self._rbuffer)
+        # unread bytes lie between _rstart and _rend, and _rscan is where to resume looking for the terminator
+        self._rstart = self._rend = self._rscan = 0
+        # every connection starts out terminated by endchars, until the ends agree on a framing
+        self._iframing = "terminator"
+        self._oframing = "terminator"
+        self.sendqueue = []
+        self.encoder = Encoder()
+        # codes from our own symbols are understood from the start, they are only sent once the client has accepted them
+        self.decoder = Decoder(symbols=self.symbols)
+        self.symbolic = False
+        # each direction is one deflate stream shared by all its compressed messages, once compression is agreed
+        self._compressor = self._decompressor = None
+        # outgoing backpressure, pending output is what is queued or paused here plus what the transport is still writing
+        self.pausedqueue = []
+        self._queuedbytes = self._pausedbytes = self._writingbytes = 0
+        # where the last message of each superseded action, and every message of the other actions they replace, sit in the sendqueue
+        self._queuedstate = {}
+        self._replaceable = set(self.superseded).union(*self.supersedes.values())
+        self.congested = False
+        self.overflowed = False
+        # the server's set of channels with output waiting, which this channel joins whenever it queues a message
+        self._dirty = None
+        # backpressure counters
+        self.congestions = 0
+        self.droppedmessages = 0
+        self.pausedmessages = 0
+    
+    def _ReadMessages(self):
+        """Decodes and dispatches every complete message in the receive buffer."""
+        while self._rstart < self._rend:
+            start = self._rstart
+            if self._iframing == "length":
+                if self._rend - start < self.lengthheader.size:
+                    break
+                length, = self.lengthheader.unpack_from(self._rbuffer, start)
+                compressed = length & self.compressedflag
+                length &= ~self.compressedflag
+                if not 0 < length <= self.maxmessagesize:
+                    raise ValueError("message length %d out of range" % length)
+                start += self.lengthheader.size
+                end = start + length
+                if end > self._rend:
+                    break
+                self._rstart = self._rscan = end
+                frame = self._Decompress(self._rview[start:end]) if compressed else self._rview[start:end]
+            else:
+                end = self._rbuffer.find(self._terminator, max(start, self._rscan), self._rend)
+                if end == -1:
+                    if self._rend - start > self.maxmessagesize:
+                        raise ValueError("message longer than %d bytes" % self.maxmessagesize)
+                    # don't search these bytes again, except for where the terminator may have been cut off
+                    self._rscan = self._rend - len(self._terminator) + 1
+                    break
+                self._rstart = self._rscan = end + len(self._terminator)
+                frame = self._rview[start:end]
+            self._Receive(frame)
+        if self._rstart == self._rend:
+            self._rstart = self._rend = self._rscan = 0
+    
+    def _Compress(self, outgoing):
+        # the sync flush ends every message on a byte boundary with the same four bytes, which are left for the reader to add
+        return self._compressor.compress(outgoing) + self._compressor.flush(zlib.Z_SYNC_FLUSH)[:-4]
+    
+    def _Decompress(self, frame):
+        if self._decompressor is None:
+            raise ValueError("compressed message without agreeing to compression")
+        data = self._decompressor.decompress(frame, self.maxmessagesize)
+        if self._decompressor.unconsumed_tail:
+            raise ValueError("decompressed message longer than %d bytes" % self.maxmessagesize)
+        return data + self._decompressor.decompress(b"\0\0\xff\xff")
+    
+    def _StartCompressing(self):
+        # a small window and memory level keep each channel's compressor to about 32KB
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -12, 5)
+        self._decompressor = zlib.decompressobj(-15)
+    
+    def _MakeRoom(self):
+        """Moves a partly received message to the front of the full receive buffer, growing it if the message needs more room."""
+        pending = self._rend - self._rstart
+        if pending == len(self._rbuffer):
+            limit = self.maxmessagesize + max(self.lengthheader.size, len(self._terminator))
+            if pending >= limit:
+                raise ValueError("message longer than %d bytes" % self.maxmessagesize)
+            rbuffer = bytearray(min(pending * 2, limit))
+            rbuffer[:pending] = self._rview[self._rstart:self._rend]
+            self._rbuffer, self._rview = rbuffer, memoryview(rbuffer)
+        elif self._rstart < pending:
+            # the old and new places overlap
+            self._rbuffer[:pending] = self._rview[self._rstart:self._rend].tobytes()
+        else:
+            self._rbuffer[:pending] = self._rview[self._rstart:self._rend]
+        self._rscan -= self._rstart
+        self._rstart, self._rend = 0, pending
+    
+    def _Receive(self, frame):
+        data = self.decoder.loads(frame)
+        if type(dict()) == type(data) and 'action' in data:
+            if data['action'] == 'framing':
+                self._AgreeFraming(data)
+            else:
+                if data['action'] == 'connected':
+                    self._ChooseFraming(data)
+                Dispatch(self, data)
+        else:
+            print("OOB data:", data)
+    
+    def _Frame(self, outgoing):
+        """Wraps an encoded message for the wire using the current outgoing framing."""
+        if self._oframing == "length":
+            return self.lengthheader.pack(len(outgoing)) + outgoing
+        return outgoing + self._terminator
+    
+    def _ChooseFraming(self, data):
+        """Picks the first framing offered by the server in its 'connected' message, if any, and accepts its symbols.
+        Everything sent after the request uses the new framing and symbols."""
+        request = {"action": "framing"}
+        for framing in self.framings:
+            if framing in data.get("framing", ()):
+                request["framing"] = framing
+                break
+        if data.get("compress") and request.get("framing") == "length":
+            request["compress"] = True
+        if data.get("symbols"):
+            try:
+                encoder, decoder = Encoder(symbols=data["symbols"]), Decoder(symbols=data["symbols"])
+            except (TypeError, ValueError):
+                print("warning: ignoring invalid symbols")
+            else:
+                request["symbols"] = True
+        if len(request) == 1:
+            return
+        self._Push(self._Frame(self.encoder.dumps(request)))
+        if "framing" in request:
+            self._oframing = request["framing"]
+        if "symbols" in request:
+            self.encoder, self.decoder, self.symbolic = encoder, decoder, True
+        if "compress" in request:
+            self._StartCompressing()
+    
+    def _AgreeFraming(self, data):
+        """Switches framing when the other end asks for it, or confirms our request.
+        Everything received after the request, and sent after the reply, uses the new framing."""
+        framing = data.get("framing")
+        if framing == self._oframing:
+            # the server has confirmed our request
+            self._iframing = framing
+        elif framing in self.framings:
+            # the client has asked for a framing, confirm it in the old framing and then switch
+            self._iframing = framing
+            self._Push(self._Frame(self.encoder.dumps({"action": "framing", "framing": framing})))
+            self._oframing = framing
+        if data.get("symbols") and self.symbols and not self.symbolic:
+            # the client has accepted our symbols
+            self.encoder = Encoder(symbols=self.symbols)
+            self.symbolic = True
+        if data.get("compress") and self.compress and self._iframing == "length" and self._compressor is None:
+            # the client has accepted compression
+            self._StartCompressing()
+    
+    def Pump(self):
+        """Writes every message queued since the last pump as one buffer, so a burst of messages costs one send.
+        Nothing more is written while the last write is still going out, which lets a congested queue build up here."""
+        if self.overflowed:
+            # closed here rather than when the queue overflowed, which may be in the middle of a broadcast
+            if self.connected:
+                self.handle_close()
+            return
+        self._writingbytes = self._WritingBytes()
+        self._CheckPending()
+        if not self.sendqueue or self._writingbytes:
+            return
+        pieces = []
+        if self._oframing == "length":
+            pack = self.lengthheader.pack
+            for d in self.sendqueue:
+                if d is None:
+                    continue
+                # compressed as it is written rather than queued, since queued messages may still be dropped
+                if self._compressor is not None and len(d) >= self.compressthreshold:
+                    d = self._Compress(d)
+                    pieces += (pack(len(d) | self.compressedflag), d)
+                else:
+                    pieces += (pack(len(d)), d)
+        else:
+            for d in self.sendqueue:
+                if d is not None:
+                    pieces += (d, self._terminator)
+        self.sendqueue = []
+        self._queuedstate = {}
+        self._queuedbytes = 0
+        if self.cork:
+            self._Cork(1)
+        self._Push(b"".join(pieces))
+        if self.cork:
+            self._Cork(0)
+        self._writingbytes = self._WritingBytes()
+    
+    def PendingBytes(self):
+        """Returns the number of bytes of output not yet handed to the socket."""
+        return self._queuedbytes + self._pausedbytes + self._writingbytes
+    
+    def _CheckPending(self):
+        """Updates the congestion state from the pending output, applying the backpressure policy."""
+        pending = self.PendingBytes()
+        if pending >= self.maxpending or (pending >= self.highwater and self.backpressure == "disconnect"):
+            self._Overflow()
+        elif not self.congested and pending >= self.highwater:
+            self.congested = True
+            self.congestions += 1
+        elif self.congested and self._queuedbytes + self._writingbytes <= self.lowwater:
+            # paused messages don't count, they are only released here
+            self.congested = False
+            # send the held back messages now that the other end is reading again
+            paused, self.pausedqueue, self._pausedbytes = self.pausedqueue, [], 0
+            [self.SendEncoded(d) for d in paused]
+    
+    def _Overflow(self):
+        """Discards the output of a channel which is not being read, it is disconnected on the next pump."""
+        self.overflowed = True
+        self.sendqueue, self.pausedqueue = [], []
+        self._queuedbytes = self._pausedbytes = 0
+        self._queuedstate = {}
+    
+    def Send(self, data):
+        """Returns the number of bytes sent after enoding."""
+        return self.SendEncoded(self.encoder.dumps(data), data.get("action") if type(data) is dict else None)
+    
+    def SendEncoded(self, outgoing, action=None):
+        """Queues a message which has already been encoded, such as one shared between several channels.
+        The action is used to apply the backpressure policy. Returns the number of bytes sent, 0 if the message was dropped."""
+        if self.overflowed:
+            return 0
+        if self._dirty is not None:
+            self._dirty.add(self)
+        if self.congested and action is not None:
+            if action in self.superseded:
+                # the new message replaces the older ones still waiting in the queue
+                for replaced in self.supersedes.get(action, (action,)):
+                    for index in self._queuedstate.pop(replaced, ()):
+                        self._queuedbytes -= len(self.sendqueue[index])
+                        self.sendqueue[index] = None
+                        self.droppedmessages += 1
+            if action in self.noncritical:
+                if self.backpressure == "drop":
+                    self.droppedmessages += 1
+                    return 0
+                if self.backpressure == "pause":
+                    self.pausedqueue.append(outgoing)
+                    self._pausedbytes += len(outgoing)
+                    self.pausedmessages += 1
+                    self._CheckPending()
+                    return len(outgoing)
+        if action in self.superseded:
+            self._queuedstate[action] = [len(self.sendqueue)]
+        elif action in self._replaceable:
+            self._queuedstate.setdefault(action, []).append(len(self.sendqueue))
+        self.sendqueue.append(outgoing)
+        self._queuedbytes += len(outgoing)
+        self._CheckPending()
+        if self._oframing == "length":
+            return len(outgoing) + self.lengthheader.size
+        return len(outgoing) + len(self._terminator)
+
+class Timer(object):
+    """A callback due at a given time, which can be cancelled like an asyncio TimerHandle."""
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+    
+    def __lt__(self, other):
+        return self.when < other.when
+    
+    def cancel(self):
+        self.callback = None
+    
+    def cancelled(self):
+        return self.callback is None
+
+class ChannelSet(object):
+    """
+    The channels of a server, which behave like the list of them they replace, iterating in the order they connected.
+    They are kept keyed by id, so adding, removing and looking one up take the same time however many are connected.
+    """
+    def __init__(self):
+        self._channels = {}
+    
+    def append(self, channel):
+        self._channels[id(channel)] = channel
+    
+    def remove(self, channel):
+        if channel not in self:
+            raise ValueError("channel not in the server's channels")
+        del self._channels[id(channel)]
+    
+    def get(self, channelid, default=None):
+        """Returns the channel whose id() is channelid."""
+        return self._channels.get(channelid, default)
+    
+    def __contains__(self, channel):
+        return self._channels.get(id(channel)) is channel
+    
+    def __iter__(self):
+        # over a copy, so channels can be removed while iterating as they could from a list
+        return iter(list(self._channels.values()))
+    
+    def __len__(self):
+        return len(self._channels)
+    
+    def __getitem__(self, index):
+        return list(self._channels.values())[index]
+
+class ServerBase(object):
+    def __init__(self):
+        self.channels = ChannelSet()
+        # channels which have queued output since they were last pumped, or are waiting to recover from congestion
+        self.dirty = set()
+        # messages shared between channels are encoded with or without symbols, as each channel has agreed
+        self.encoder = Encoder()
+        self.symbolencoder = Encoder(symbols=self.channelClass.symbols)
+        self.serving = False
+        # heap of Timers waiting to be run by Pump
+        self._timers = []
+        # numbers the clients of Unix domain sockets, which have no address of their own
+        self._unnamed = itertools.count(1)
+    
+    def _Name(self, addr, sockname):
+        """Returns the address of a client, or ("unix:<path>", n) for the nth client of the Unix domain socket listening at path."""
+        return addr or ("unix:" + sockname, next(self._unnamed))
+    
+    def CallLater(self, delay, callback, *args):
+        """Calls callback(*args) from the first pump at least delay seconds from now. Returns a Timer which can be cancelled."""
+        timer = Timer(monotonic() + delay, callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+    
+    def _Timeout(self, timeout):
+        """Shortens how long a pump may wait for I/O, so that it wakes for the next timer. A timeout of None waits as long as it takes."""
+        while self._timers and self._timers[0].cancelled():
+            heapq.heappop(self._timers)
+        if not self._timers:
+            return timeout
+        due = max(0.0, self._timers[0].when - monotonic())
+        return due if timeout is None else min(timeout, due)
+    
+    def _RunTimers(self):
+        now = monotonic()
+        while self._timers and self._timers[0].when <= now:
+            timer = heapq.heappop(self._timers)
+            if not timer.cancelled():
+                timer.callback(*timer.args)
+    
+    def _PumpChannels(self):
+        """Writes the queue of every channel with output waiting, leaving idle channels alone."""
+        for c in list(self.dirty):
+            if c.connected:
+                c.Pump()
+            if not c.connected or not (c.sendqueue or c.pausedqueue or c.congested):
+                self.dirty.discard(c)
+    
+    def ServeForever(self):
+        """Pumps until Stop is called from a handler or timer, sleeping in the poller until I/O arrives or a timer is due."""
+        self.serving = True
+        while self.serving:
+            self.Pump(None)
+    
+    def Stop(self):
+        self.serving = False
+    
+    def _Accepted(self, channel, addr):
+        """Greets a newly connected channel."""
+        self.channels.append(channel)
+        channel._dirty = self.dirty
+        # offer the framings we support, older clients will ignore the offer and keep to the terminator
+        greeting = {"action": "connected", "framing": list(channel.framings)}
+        if channel.symbols:
+            greeting["symbols"] = list(channel.symbols)
+        if channel.compress:
+            greeting["compress"] = True
+        channel.Send(greeting)
+        if hasattr(self, "Connected"):
+            self.Connected(channel, addr)
+    
+    def Broadcast(self, data, recipients=None):
+        """Encodes data once, or once each with and without symbols, and queues the same bytes on every recipient channel,
+        all channels by default. Returns the size of the largest encoding."""
+        outgoing = {}
+        action = data.get("action") if type(data) is dict else None
+        for c in self.channels if recipients is None else recipients:
+            if c.symbolic not in outgoing:
+                outgoing[c.symbolic] = (self.symbolencoder if c.symbolic else self.encoder).dumps(data)
+            c.SendEncoded(outgoing[c.symbolic], action)
+        return max([len(o) for o in outgoing.values()] or [0])
+    
+    def BroadcastEach(self, data, extra):
+        """Sends each channel in the extra dictionary the dict data merged with that channel's own dict of extra fields.
+        The shared fields are encoded once, and only the small per channel fields are encoded per recipient."""
+        items = {}
+        for c, fields in extra.items():
+            encoder = self.symbolencoder if c.symbolic else self.encoder
+            if c.symbolic not in items:
+                items[c.symbolic] = encoder.dumps_items(data)
+            c.SendEncoded(encoder.dumps_merged(items[c.symbolic], fields), data.get("action"))
+
+class EndPointBase(object):
+    """
+    The endpoint queues up all network events for other classes to read.
+    """
+    # maps an action to the actions it makes pointless when they arrived earlier in the same pump,
+    # for example {"state": ("state",)} to only read the latest "state" snapshot
+    supersedes = {}
+    
+    def __init__(self, address=("127.0.0.1", 31425)):
+        self.address = address
+        self.isConnected = False
+        self.queue = []
+        self._greeted = False
+    
+    def GetQueue(self, supersedes=None):
+        """Returns the messages received in the last pump, leaving out any superseded by a later message."""
+        if supersedes is None:
+            supersedes = self.supersedes
+        if not supersedes or not any(d["action"] in supersedes for d in self.queue):
+            return self.queue
+        # walk back from the newest message, dropping whatever a later message has superseded
+        queue = []
+        dropping = set()
+        for d in reversed(self.queue):
+            if d["action"] in dropping:
+                continue
+            queue.append(d)
+            dropping.update(supersedes.get(d["action"], ()))
+        queue.reverse()
+        return queue
+    
+    def _ChooseFraming(self, data):
+        ChannelBase._ChooseFraming(self, data)
+        self._greeted = True
+    
+    # methods to add network data to the queue depending on network events
+    
+    def Close(self):
+        self.isConnected = False
+        self.close()
+        self.queue.append({"action": "disconnected"})
+    
+    def Connected(self):
+        self.queue.append({"action": "socketConnect"})
+    
+    def Network_connected(self, data):
+        self.isConnected = True
+    
+    def Network(self, data):
+        self.queue.append(data)
+    
+    def Error(self, error):
+        self.queue.append({"action": "error", "error": error})
+    
+    def ConnectionError(self):
+        self.isConnected = False
+        self.queue.append({"action": "error", "error": (-1, "Connection error")})
@@ -1,40 +1,61 @@
 from __future__ import print_function
 import sys
+import socket
+from errno import ECONNRESET, ENOTCONN, ESHUTDOWN, ECONNABORTED, EPIPE, EBADF
 
-from podsixnet2.asyncwrapper import asynchat
-from podsixnet2.rencode import loads, dumps
+from podsixnet2.asyncwrapper import asynchat, SelectorMap
+from podsixnet2.Base import ChannelBase
+from podsixnet2.sockopts import TuneSocket
 
-class Channel(asynchat.async_chat):
-    endchars = '\0---\0'
+DISCONNECTED = frozenset((ECONNRESET, ENOTCONN, ESHUTDOWN, ECONNABORTED, EPIPE, EBADF))
+
+class Channel(ChannelBase, asynchat.async_chat):
     def __init__(self, conn=None, addr=(), server=None, map=None):
         asynchat.async_chat.__init__(self, getattr(conn, "socket", conn), map)
+        ChannelBase.__init__(self)
         self.addr = addr
         self._server = server
-        self._ibuffer = b""
-        self.set_terminator(self.endchars.encode())
-        self.sendqueue = []
-    
-    def collect_incoming_data(self, data):
-        self._ibuffer += data
-    
-    def found_terminator(self):
-        data = loads(self._ibuffer)
-        self._ibuffer = b""
-        
-        if type(dict()) == type(data) and 'action' in data:
-            [getattr(self, n)(data) for n in ('Network_' + data['action'], 'Network') if hasattr(self, n)]
-        else:
-            print("OOB data:", data)
+        if self.socket is not None:
+            self._Tune()
+    
+    def handle_read(self):
+        if self._rend == len(self._rbuffer):
+            self._MakeRoom()
+        try:
+            received = self.socket.recv_into(self._rview[self._rend:])
+        except BlockingIOError:
+            return
+        except OSError as why:
+            if why.errno in DISCONNECTED:
+                self.handle_close()
+            else:
+                self.handle_error()
+            return
+        if not received:
+            self.handle_close()
+            return
+        self._rend += received
+        self._ReadMessages()
+    
+    def _Push(self, data):
+        asynchat.async_chat.push(self, data)
+        if self.producer_fifo and isinstance(self._map, SelectorMap):
+            # the rest goes out once the socket is writable again
+            self._map.recheck(self._fileno)
+    
+    def _Tune(self):
+        TuneSocket(self.socket, self.sendbuffer, self.recvbuffer, self.keepalive)
     
-    def Pump(self):
-        [asynchat.async_chat.push(self, d) for d in self.sendqueue]
-        self.sendqueue = []
+    def _WritingBytes(self):
+        return sum(map(len, self.producer_fifo))
     
-    def Send(self, data):
-        """Returns the number of bytes sent after enoding."""
-        outgoing = dumps(data) + self.endchars.encode()
-        self.sendqueue.append(outgoing)
-        return len(outgoing)
+    def _Cork(self, corked):
+        """Sets TCP_CORK on platforms which have it, so the kernel only sends full packets until uncorked."""
+        if hasattr(socket, "TCP_CORK") and self.socket is not None:
+            try:
+                self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, corked)
+            except socket.error:
+                pass
     
     def handle_connect(self):
         if hasattr(self, "Connected"):
@@ -10,7 +10,13 @@ Subclass ConnectionListener in order to have an object that will receive network
 
 from __future__ import print_function
 
-from podsixnet2.EndPoint import EndPoint
+from podsixnet2.Base import Dispatch
+
+try:
+    from podsixnet2.EndPoint import EndPoint
+except ImportError:
+    # asyncore and asynchat were removed in Python 3.12
+    from podsixnet2.aio import EndPoint
 
 connection = EndPoint()
 
@@ -20,19 +26,26 @@ class ConnectionListener:
     Subclass this to have your own classes monitor incoming network messages.
     For example, a method called "Network_players(self, data)" will be called when a message arrives like:
         {"action": "players", "number": 5, ....}
+    Methods can also be registered for actions with the podsixnet2.Base.handles decorator, and UnknownAction(data) is called for
+    messages no method handles. Handlers are looked up once per class, so they can't be added to an instance later.
+    Set supersedes to skip messages made pointless by a later one in the same pump, see EndPoint.supersedes.
+    Set connection to talk through an endpoint other than the shared one, such as a LoopbackEndPoint to a server in the same process.
     """
+    supersedes = None
+    connection = connection
+    
     def Connect(self, *args, **kwargs):
-        connection.DoConnect(*args, **kwargs)
+        self.connection.DoConnect(*args, **kwargs)
         # check for connection errors:
         self.Pump()
     
     def Pump(self):
-        for data in connection.GetQueue():
-            [getattr(self, n)(data) for n in ("Network_" + data['action'], "Network") if hasattr(self, n)]
-                
+        for data in self.connection.GetQueue(self.supersedes):
+            Dispatch(self, data)
+    
     def Send(self, data):
         """ Convenience method to allow this listener to appear to send network data, whilst actually using connection. """
-        connection.Send(data)
+        self.connection.Send(data)
 
 if __name__ == "__main__":
     from time import sleep
@@ -0,0 +1,141 @@
+"""
+Connects a client to a server in the same process, handing messages over in memory instead of through a socket.
+
+A LoopbackEndPoint stands in for the EndPoint of a ConnectionListener, and the server sees an ordinary channel of its channelClass,
+so the handlers on neither side change. Messages are still only handled when the other side pumps, as they would be over TCP,
+but nothing is framed, written or polled for. The server's other clients keep connecting over TCP.
+"""
+
+from __future__ import print_function
+
+from podsixnet2.Base import EndPointBase, Dispatch
+from podsixnet2.rencode import Encoder, Decoder
+
+def Receive(receiver, data):
+    """Handles a message handed over in memory, decoding it first unless it was handed over as it was sent."""
+    if type(data) is bytes:
+        data = receiver.decoder.loads(data)
+    if type(data) is dict and 'action' in data:
+        Dispatch(receiver, data)
+    else:
+        print("OOB data:", data)
+
+class LoopbackChannel(object):
+    """
+    Mixed in before a server's channel class, replacing the channel's socket with the endpoint it is looped back to.
+    """
+    def _Loop(self, endpoint):
+        self._endpoint = endpoint
+        # messages from the endpoint waiting for the server's next pump, None when it has hung up
+        self._inbox = []
+        self.connected = True
+    
+    def _Deliver(self, data):
+        self._inbox.append(data)
+        if self._dirty is not None:
+            self._dirty.add(self)
+    
+    def Send(self, data):
+        if self._endpoint.serialize:
+            return super(LoopbackChannel, self).Send(data)
+        if self.connected:
+            self._endpoint._Deliver(data)
+        return 0
+    
+    def SendEncoded(self, outgoing, action=None):
+        if not self.connected:
+            return 0
+        self._endpoint._Deliver(outgoing)
+        return len(outgoing)
+    
+    def Pump(self):
+        """Handles the messages the endpoint has sent since the last pump."""
+        inbox, self._inbox = self._inbox, []
+        for data in inbox:
+            if data is None:
+                # the endpoint has already hung up, so closing doesn't hand the hang-up back to it
+                self.connected = False
+                self.handle_close()
+                return
+            Receive(self, data)
+    
+    def close(self):
+        if self.connected:
+            self.connected = False
+            self._endpoint._Deliver(None)
+    
+    def handle_close(self):
+        if hasattr(self, "Close"):
+            self.Close()
+        self.close()
+
+# the loopback version of each channel class, made the first time a client loops back to a server using it
+_classes = {}
+
+def LoopbackClass(channelClass):
+    """Returns channelClass with its socket replaced by a loopback."""
+    if channelClass not in _classes:
+        _classes[channelClass] = type("Loopback" + channelClass.__name__, (LoopbackChannel, channelClass), {})
+    return _classes[channelClass]
+
+class LoopbackEndPoint(EndPointBase):
+    """
+    The endpoint of a client in the same process as its server, which queues up network events for other classes to read like an EndPoint.
+    """
+    # whether messages sent with Send are encoded and decoded as they would be on the wire, so neither side can change the objects
+    # the other has sent. Messages a server encodes once for several channels always are.
+    serialize = True
+    
+    def __init__(self, server):
+        EndPointBase.__init__(self, ("loopback", 0))
+        self.server = server
+        self.encoder = Encoder()
+        self.decoder = Decoder()
+        self.channel = None
+        self.connected = False
+        self._justconnected = False
+        # messages from the channel waiting for the next pump, None when it has hung up
+        self._inbox = []
+    
+    def DoConnect(self, address=None):
+        """Opens a channel on the server, which greets it as if it had connected over TCP. The address is ignored."""
+        self.channel = LoopbackClass(self.server.channelClass)(None, ("loopback", id(self)), self.server)
+        self.channel._Loop(self)
+        self.connected = True
+        self._justconnected = True
+        # there is no framing to agree on
+        self._greeted = True
+        self._inbox = []
+        self.server._Accepted(self.channel, self.channel.addr)
+    
+    def _Deliver(self, data):
+        self._inbox.append(data)
+    
+    def Send(self, data):
+        """Hands the message to the server's channel, to be handled on the server's next pump. Returns the encoded size, 0 if it isn't encoded."""
+        if not self.connected:
+            return 0
+        if self.serialize:
+            data = self.encoder.dumps(data)
+        self.channel._Deliver(data)
+        return len(data) if self.serialize else 0
+    
+    def Pump(self, timeout=0.0):
+        """Collects the messages the server has sent since the last pump. Nothing is waited for, so the timeout is ignored."""
+        self.queue = []
+        if self._justconnected:
+            self._justconnected = False
+            self.Connected()
+        inbox, self._inbox = self._inbox, []
+        for data in inbox:
+            if data is None:
+                # the server has closed the channel, so closing doesn't hand the hang-up back to it
+                self.connected = False
+                self.Close()
+                return
+            Receive(self, data)
+    
+    def close(self):
+        if self.connected:
+            self.connected = False
+            self.channel._Deliver(None)
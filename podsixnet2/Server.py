@@ -1,40 +1,108 @@
 from __future__ import print_function
 import socket
 
-from podsixnet2.asyncwrapper import poll, asyncore
+from podsixnet2.asyncwrapper import poll, asyncore, SelectorMap
+from podsixnet2.Base import ServerBase
 from podsixnet2.Channel import Channel
+from podsixnet2.Supervisor import TakeOver
+from podsixnet2.sockopts import Listen
 
-class Server(asyncore.dispatcher):
+class Handoff(asyncore.dispatcher):
+    """ Adopts the connections a Supervisor hands over to this server's process. """
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, server._map)
+        self._server = server
+    
+    def handle_read(self):
+        taken, gone = TakeOver(self.socket)
+        [self._server.Adopt(conn, addr) for conn, addr in taken]
+        if gone:
+            self.handle_close()
+    
+    def writable(self):
+        return False
+    
+    def handle_close(self):
+        # no more connections are coming, so finish serving
+        self.close()
+        self._server.Stop()
+
+class Listener(asyncore.dispatcher):
+    """ Accepts connections for a server on another of its addresses. """
+    def __init__(self, sock, server):
+        asyncore.dispatcher.__init__(self, sock, server._map)
+        self.accepting = True
+        self._server = server
+    
+    def handle_accept(self):
+        self._server._AcceptAll(self)
+    
+    def writable(self):
+        return False
+
+class Server(ServerBase, asyncore.dispatcher):
     channelClass = Channel
+    # the socket map, a plain dict polls with select() instead of keeping the sockets registered with epoll
+    mapClass = SelectorMap
     
-    def __init__(self, channelClass=None, localaddr=("127.0.0.1", 5071), listeners=5):
+    def __init__(self, channelClass=None, localaddr=("127.0.0.1", 5071), listeners=socket.SOMAXCONN, reuseport=False):
         if channelClass:
             self.channelClass = channelClass
-        self._map = {}
-        self.channels = []
+        # the most connections waiting to be accepted, which is also the most accepted per poll
+        self.listeners = listeners
+        # the Listeners added by AddListener
+        self._listeners = []
+        self._map = self.mapClass()
+        ServerBase.__init__(self)
         asyncore.dispatcher.__init__(self, map=self._map)
-        self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-        self.set_reuse_addr()
-        self.bind(localaddr)
-        self.listen(listeners)
+        if localaddr is None:
+            # connections will be handed over by a supervisor
+            return
+        self.set_socket(Listen(localaddr, listeners, reuseport, self.channelClass.sendbuffer, self.channelClass.recvbuffer, self.channelClass.keepalive), self._map)
+        self.accepting = True
+        self.addr = localaddr
+    
+    def AddListener(self, address, listeners=socket.SOMAXCONN, reuseport=False):
+        """Also accepts connections on address, such as a Unix domain socket at "unix:/path" beside the TCP port."""
+        listener = Listener(Listen(address, listeners, reuseport, self.channelClass.sendbuffer, self.channelClass.recvbuffer, self.channelClass.keepalive), self)
+        self._listeners.append(listener)
+        return listener
     
     def handle_accept(self):
-        try:
-            conn, addr = self.accept()
-        except socket.error:
-            print('warning: server accept() threw an exception')
-            return
-        except TypeError:
-            print('warning: server accept() threw EWOULDBLOCK')
-            return
-        # print("connection")
-        self.channels.append(self.channelClass(conn, addr, self, self._map))
-        self.channels[-1].Send({"action": "connected"})
-        if hasattr(self, "Connected"):
-            self.Connected(self.channels[-1], addr)
-    
-    def Pump(self):
-        [c.Pump() for c in self.channels]
-        poll(map=self._map)
-
+        self._AcceptAll(self)
+    
+    def _AcceptAll(self, listener):
+        # drain the backlog, so a burst of connections doesn't wait a poll each
+        for x in range(self.listeners):
+            try:
+                accepted = listener.accept()
+            except socket.error:
+                print('warning: server accept() threw an exception')
+                return
+            if accepted is None:
+                # EWOULDBLOCK, there are no more waiting
+                return
+            # print("connection")
+            conn, addr = accepted
+            self.Adopt(conn, self._Name(addr, conn.getsockname()))
+    
+    def Adopt(self, conn, addr):
+        """Serves a connection accepted elsewhere, or by this server."""
+        self._Accepted(self.channelClass(conn, addr, self, self._map), addr)
+    
+    def AddHandoff(self, handoff):
+        """Serves the connections a Supervisor hands over on the handoff socket, and stops serving once the supervisor goes."""
+        Handoff(handoff, self)
+    
+    def close(self):
+        for listener in self._listeners:
+            listener.close()
+        self._listeners = []
+        asyncore.dispatcher.close(self)
+    
+    def Pump(self, timeout=0.0):
+        """Writes the queue of every channel with output waiting, then waits up to timeout seconds for I/O, or until the next timer is due, and handles it.
+        A timeout of None waits as long as it takes."""
+        self._PumpChannels()
+        poll(self._Timeout(timeout), map=self._map)
+        self._RunTimers()
@@ -0,0 +1,116 @@
+"""
+Runs a server on several processes, so it isn't limited to one core.
+
+A Supervisor accepts every connection on a single listening socket and hands each one over to one of its forked worker processes,
+passing the socket's file descriptor down a Unix socket. Each worker runs its own Server, which serves the connections it is handed.
+Connections are handed over in groups of consecutive clients, so clients that connect together, such as the players of one game,
+usually land on the same worker. The grouping knows nothing of what the clients go on to do, so it is best effort only.
+Descriptor passing needs a Unix platform.
+"""
+
+from __future__ import print_function
+import os
+import socket
+import sys
+import traceback
+
+from podsixnet2.rencode import dumps, loads
+from podsixnet2.sockopts import Listen
+
+def HandOver(handoff, conn, addr):
+    """Sends a connected socket and its address down a handoff socket."""
+    socket.send_fds(handoff, [dumps(list(addr))], [conn.fileno()])
+
+def TakeOver(handoff):
+    """Receives the sockets waiting on a handoff socket, returning a list of (conn, addr) and whether the supervisor has gone."""
+    taken = []
+    while True:
+        try:
+            msg, fds, flags, addr = socket.recv_fds(handoff, 4096, 1)
+        except BlockingIOError:
+            return taken, False
+        if not fds:
+            return taken, True
+        taken.append((socket.socket(fileno=fds[0]), tuple(loads(msg))))
+
+class Supervisor(object):
+    def __init__(self, localaddr=("127.0.0.1", 5071), workers=2, group=1, listeners=socket.SOMAXCONN, reuseport=False,
+                 sendbuffer=None, recvbuffer=None, keepalive=None):
+        self.workers = workers
+        # how many consecutive connections go to the same worker
+        self.group = group
+        # tuned like a Server's listener, so the connections it hands over inherit the options
+        self.listener = Listen(localaddr, listeners, reuseport, sendbuffer, recvbuffer, keepalive)
+        # Run waits in accept()
+        self.listener.setblocking(True)
+        self.addr = self.listener.getsockname()
+        # (pid, handoff socket) of every worker still running
+        self._workers = []
+        self._next = 0
+        self._handed = 0
+    
+    def Run(self, work):
+        """Forks the workers, each of which calls work(handoff) with the socket its connections arrive on and exits when it returns.
+        Then hands over connections until interrupted, and waits for the workers to finish."""
+        for x in range(self.workers):
+            self._Fork(work)
+        try:
+            while self._workers:
+                conn, addr = self.listener.accept()
+                try:
+                    self._Route(conn, addr)
+                finally:
+                    conn.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.Close()
+    
+    def _Fork(self, work):
+        handoff, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self.listener.close()
+                handoff.close()
+                [w.close() for p, w in self._workers]
+                work(theirs)
+                status = 0
+            except BaseException:
+                # os._exit skips the interpreter's own report, so say why the worker died
+                traceback.print_exc()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+        theirs.close()
+        self._workers.append((pid, handoff))
+    
+    def _Route(self, conn, addr):
+        """Hands the connection to the current worker, moving on to the next worker after each group."""
+        while self._workers:
+            pid, handoff = self._workers[self._next % len(self._workers)]
+            try:
+                HandOver(handoff, conn, addr)
+            except OSError:
+                # the worker has exited, leave it out from now on
+                print("warning: worker %d has gone" % pid)
+                self._workers.remove((pid, handoff))
+                handoff.close()
+                continue
+            self._handed += 1
+            if self._handed % self.group == 0:
+                self._next = (self._next + 1) % len(self._workers)
+            return
+    
+    def Close(self):
+        """Stops handing over connections, which tells the workers to finish, and waits for them."""
+        self.listener.close()
+        for pid, handoff in self._workers:
+            handoff.close()
+        for pid, handoff in self._workers:
+            try:
+                os.waitpid(pid, 0)
+            except (ChildProcessError, KeyboardInterrupt):
+                pass
+        self._workers = []
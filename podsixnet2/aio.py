@@ -0,0 +1,245 @@
+"""
+Server, Channel and EndPoint on asyncio instead of asyncore, for Pythons which no longer ship asyncore and asynchat.
+
+They keep the same API: Network_<action> methods are called for incoming messages, Send queues a message and Pump writes the queue.
+Each Server and EndPoint runs its own event loop unless given one, and Pump runs one iteration of it without blocking.
+A server can also be left to run on its loop, with loop.run_forever(), since channels write their queues at the end of each iteration by themselves.
+"""
+
+from __future__ import print_function
+import asyncio
+import socket
+import traceback
+
+from podsixnet2.Base import ChannelBase, ServerBase, EndPointBase
+from podsixnet2.Supervisor import TakeOver
+from podsixnet2.sockopts import TuneSocket, ParseAddress, Listen
+
+def RunOnce(loop):
+    """Runs the callbacks that are ready and handles any I/O that is waiting, without blocking."""
+    loop.call_soon(loop.stop)
+    loop.run_forever()
+
+def RunFor(loop, timeout):
+    """Runs the loop for timeout seconds, handling I/O as it arrives. A timeout of None runs until the loop is stopped."""
+    if timeout == 0:
+        RunOnce(loop)
+        return
+    stopping = loop.call_later(timeout, loop.stop) if timeout is not None else None
+    loop.run_forever()
+    if stopping is not None:
+        stopping.cancel()
+
+class Channel(ChannelBase, asyncio.BufferedProtocol):
+    def __init__(self, conn=None, addr=(), server=None, loop=None):
+        ChannelBase.__init__(self)
+        self.addr = addr
+        self._server = server
+        self._loop = loop
+        self.transport = None
+        self.connected = False
+        self._flushing = False
+    
+    # asyncio protocol callbacks
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.connected = True
+        self.addr = transport.get_extra_info("peername") or self.addr
+        if self._server is not None:
+            self.addr = self._server._Name(self.addr, transport.get_extra_info("sockname"))
+        # ask to be paused as soon as anything is left unwritten, and resumed once it has all gone out
+        transport.set_write_buffer_limits(0)
+        if transport.get_extra_info("socket") is not None:
+            TuneSocket(transport.get_extra_info("socket"), self.sendbuffer, self.recvbuffer, self.keepalive)
+        if self._server is not None:
+            self._server._Accepted(self, self.addr)
+        elif hasattr(self, "Connected"):
+            self.Connected()
+        else:
+            print("Unhandled Connected()")
+    
+    def get_buffer(self, sizehint):
+        if self._rend == len(self._rbuffer):
+            self._MakeRoom()
+        return self._rview[self._rend:]
+    
+    def buffer_updated(self, nbytes):
+        self._rend += nbytes
+        try:
+            self._ReadMessages()
+        except Exception as e:
+            self.handle_error(e)
+    
+    def resume_writing(self):
+        if self.sendqueue:
+            self._ScheduleFlush()
+    
+    def connection_lost(self, exc):
+        if self.connected:
+            self.handle_close()
+    
+    # transport used by ChannelBase
+    
+    def _Push(self, data):
+        self.transport.write(data)
+    
+    def _WritingBytes(self):
+        return self.transport.get_write_buffer_size() if self.transport is not None else 0
+    
+    def _Cork(self, corked):
+        """Sets TCP_CORK on platforms which have it, so the kernel only sends full packets until uncorked."""
+        sock = self.transport.get_extra_info("socket") if self.transport is not None else None
+        if hasattr(socket, "TCP_CORK") and sock is not None:
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, corked)
+            except socket.error:
+                pass
+    
+    def SendEncoded(self, outgoing, action=None):
+        if not self._flushing and self.connected:
+            self._ScheduleFlush()
+        return ChannelBase.SendEncoded(self, outgoing, action)
+    
+    def _ScheduleFlush(self):
+        """Writes the queue at the end of this loop iteration, so everything sent before then goes out together."""
+        self._flushing = True
+        self._loop.call_soon(self._Flush)
+    
+    def _Flush(self):
+        self._flushing = False
+        ChannelBase.Pump(self)
+    
+    def close(self):
+        self.connected = False
+        if self.transport is not None:
+            self.transport.close()
+    
+    def handle_error(self, error):
+        if hasattr(self, "Error"):
+            self.Error(error)
+        else:
+            traceback.print_exception(type(error), error, error.__traceback__)
+        # closing clears connected, so connection_lost won't call Close again
+        self.handle_close()
+    
+    def handle_close(self):
+        if hasattr(self, "Close"):
+            self.Close()
+        self.close()
+
+class Server(ServerBase):
+    channelClass = Channel
+    
+    def __init__(self, channelClass=None, localaddr=("127.0.0.1", 5071), listeners=socket.SOMAXCONN, reuseport=False, loop=None):
+        if channelClass:
+            self.channelClass = channelClass
+        ServerBase.__init__(self)
+        self._ownloop = loop is None
+        self.loop = loop or asyncio.new_event_loop()
+        # the asyncio servers listening on each address
+        self._listeners = []
+        if localaddr is None:
+            # connections will be handed over by a supervisor
+            return
+        self.addr = self.AddListener(localaddr, listeners, reuseport).sockets[0].getsockname()
+        if ParseAddress(localaddr)[0] != socket.AF_INET:
+            self.addr = localaddr
+    
+    def AddListener(self, address, listeners=socket.SOMAXCONN, reuseport=False):
+        """Also accepts connections on address, such as a Unix domain socket at "unix:/path" beside the TCP port."""
+        listener = self.loop.run_until_complete(self.loop.create_server(
+            lambda: self.channelClass(server=self, loop=self.loop),
+            sock=Listen(address, listeners, reuseport, self.channelClass.sendbuffer, self.channelClass.recvbuffer, self.channelClass.keepalive)))
+        self._listeners.append(listener)
+        return listener
+    
+    def Adopt(self, conn, addr):
+        """Serves a connection accepted elsewhere."""
+        self.loop.create_task(self.loop.connect_accepted_socket(lambda: self.channelClass(server=self, loop=self.loop), conn))
+    
+    def AddHandoff(self, handoff):
+        """Serves the connections a Supervisor hands over on the handoff socket, and stops serving once the supervisor goes."""
+        handoff.setblocking(False)
+        self.loop.add_reader(handoff.fileno(), self._TakeOver, handoff)
+    
+    def _TakeOver(self, handoff):
+        taken, gone = TakeOver(handoff)
+        [self.Adopt(conn, addr) for conn, addr in taken]
+        if gone:
+            self.loop.remove_reader(handoff.fileno())
+            handoff.close()
+            self.Stop()
+    
+    def Pump(self, timeout=0.0):
+        """Writes the queue of every channel with output waiting, then runs the loop for up to timeout seconds, until Stop if it is None.
+        Unlike the asyncore server nothing waits for the pump, messages are answered and timers run as soon as they are due."""
+        self._PumpChannels()
+        RunFor(self.loop, timeout)
+    
+    def CallLater(self, delay, callback, *args):
+        return self.loop.call_later(delay, callback, *args)
+    
+    def Stop(self):
+        ServerBase.Stop(self)
+        if self.loop.is_running():
+            self.loop.stop()
+    
+    def close(self):
+        for listener in self._listeners:
+            listener.close()
+        for c in self.channels:
+            c.close()
+        # let the transports finish closing
+        RunOnce(self.loop)
+        if self._ownloop:
+            self.loop.close()
+
+class EndPoint(EndPointBase, Channel):
+    """
+    The endpoint queues up all network events for other classes to read.
+    """
+    def __init__(self, address=("127.0.0.1", 31425), loop=None):
+        EndPointBase.__init__(self, address)
+        self.loop = loop or asyncio.new_event_loop()
+        Channel.__init__(self, loop=self.loop)
+    
+    def DoConnect(self, address=None):
+        if address:
+            self.address = address
+        self._greeted = False
+        Channel.__init__(self, loop=self.loop)
+        family, sockaddr = ParseAddress(self.address)
+        if family == socket.AF_INET:
+            connecting = self.loop.create_task(self.loop.create_connection(lambda: self, sockaddr[0], sockaddr[1]))
+        else:
+            connecting = self.loop.create_task(self.loop.create_unix_connection(lambda: self, sockaddr))
+        connecting.add_done_callback(self._ConnectDone)
+    
+    def close(self):
+        Channel.close(self)
+        # outside of a pump, run the loop so the socket is closed now rather than on the next pump
+        if not self.loop.is_running():
+            RunOnce(self.loop)
+    
+    def _ConnectDone(self, connecting):
+        if not connecting.cancelled() and connecting.exception() is not None:
+            self.Error(connecting.exception())
+    
+    def _Flush(self):
+        # hold outgoing messages until the server has greeted us, so they go out in the agreed framing
+        self._flushing = False
+        if self._greeted:
+            ChannelBase.Pump(self)
+    
+    def _ChooseFraming(self, data):
+        EndPointBase._ChooseFraming(self, data)
+        if self.sendqueue:
+            self._ScheduleFlush()
+    
+    def Pump(self, timeout=0.0):
+        """Writes the queue and runs the loop for up to timeout seconds, collecting every message that arrives meanwhile."""
+        if self._greeted:
+            ChannelBase.Pump(self)
+        self.queue = []
+        RunFor(self.loop, timeout)
@@ -1,13 +1,15 @@
 """ monkey patched version of asynchat to allow map argument on all version of Python, and the best version of the poll function. """
 from sys import version
+import select
+import selectors
 
 import asynchat
 import asyncore
 
 if float(version[:3]) < 2.5:
-    from asyncore import poll2 as poll
+    from asyncore import poll2 as mappoll
 else:
-    from asyncore import poll
+    from asyncore import poll as mappoll
 
 # monkey patch older versions to support maps in asynchat. Yuck.
 if float(version[:3]) < 2.6:
@@ -18,3 +20,83 @@ if float(version[:3]) < 2.6:
         asyncore.dispatcher.__init__ (self, sock=conn, map=map)
         
     #asynchat.async_chat.__init__ = asynchat_monkey_init
+
+class SelectorMap(dict):
+    """ A socket map which keeps every socket registered with a selector (epoll on Linux), instead of passing them all to select() on every poll.
+    Sockets are watched for reading all the time, and for writing only while they have output waiting or are connecting. """
+    def __init__(self, selector=None):
+        dict.__init__(self)
+        self.selector = selector or selectors.DefaultSelector()
+        # descriptors whose write interest needs checking at the next poll
+        self._recheck = set()
+        # descriptors currently watched for writing
+        self._writing = set()
+    
+    def __setitem__(self, fd, obj):
+        dict.__setitem__(self, fd, obj)
+        if fd in self.selector.get_map():
+            # the descriptor was closed and reused without being removed from the map
+            self.selector.unregister(fd)
+        self.selector.register(fd, selectors.EVENT_READ)
+        self._recheck.add(fd)
+    
+    def __delitem__(self, fd):
+        dict.__delitem__(self, fd)
+        self._forget(fd)
+    
+    def pop(self, fd, *default):
+        if fd in self:
+            self._forget(fd)
+        return dict.pop(self, fd, *default)
+    
+    def clear(self):
+        [self._forget(fd) for fd in list(self)]
+        dict.clear(self)
+    
+    def _forget(self, fd):
+        self._recheck.discard(fd)
+        self._writing.discard(fd)
+        try:
+            self.selector.unregister(fd)
+        except (KeyError, ValueError):
+            pass
+    
+    def recheck(self, fd):
+        """ Tells the map that the dispatcher for this descriptor may have something to write. """
+        if fd in self:
+            self._recheck.add(fd)
+    
+    def _update(self):
+        """ Brings the write interest of the rechecked and writing descriptors up to date. """
+        for fd in self._recheck | self._writing:
+            obj = self.get(fd)
+            if obj is None:
+                continue
+            writing = obj.writable() and not obj.accepting
+            if writing != (fd in self._writing):
+                self.selector.modify(fd, selectors.EVENT_READ | selectors.EVENT_WRITE if writing else selectors.EVENT_READ)
+                if writing:
+                    self._writing.add(fd)
+                else:
+                    self._writing.discard(fd)
+        self._recheck.clear()
+    
+    def poll(self, timeout=0.0):
+        self._update()
+        for key, events in self.selector.select(timeout):
+            obj = self.get(key.fd)
+            if obj is None:
+                continue
+            flags = 0
+            if events & selectors.EVENT_READ and obj.readable():
+                flags |= select.POLLIN
+            if events & selectors.EVENT_WRITE:
+                flags |= select.POLLOUT
+            asyncore.readwrite(obj, flags)
+
+def poll(timeout=0.0, map=None):
+    """ Handles whatever I/O is ready on the sockets in the map, using its selector if it is a SelectorMap. """
+    if isinstance(map, SelectorMap):
+        map.poll(timeout)
+    else:
+        mappoll(timeout, map)
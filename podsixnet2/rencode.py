@@ -65,15 +65,16 @@ same rencode version throughout your project.
 
 import struct
 import sys
-from threading import Lock
+import threading
 
 __version__ = ("Python", 1, 0, 5)
-__all__ = ('dumps', 'loads')
+__all__ = ('dumps', 'loads', 'Encoder', 'Decoder')
 
 py3 = sys.version_info[0] >= 3
 if py3:
     long = int
     unicode = str
+    intern = sys.intern
 
     def int2byte(c):
         return bytes([c])
@@ -87,6 +88,10 @@ DEFAULT_FLOAT_BITS = 32
 # Maximum length of integer when written as base 10 string.
 MAX_INT_LENGTH = 64
 
+# Default maximum nesting of containers, so hostile or cyclic data
+# cannot exhaust the stack.
+DEFAULT_MAX_DEPTH = 100
+
 # The bencode 'typecodes' such as i, d, etc have been extended and
 # relocated on the base-256 character set.
 CHR_TUPLE = int2byte(58)
@@ -103,6 +108,9 @@ CHR_TRUE = int2byte(67)
 CHR_FALSE = int2byte(68)
 CHR_NONE = int2byte(69)
 CHR_TERM = int2byte(127)
+# A string from the symbol table shared by both ends, followed by its
+# one byte index.
+CHR_SYMBOL = int2byte(45)
 
 # Positive integers with value embedded in typecode.
 INT_POS_FIXED_START = 0
@@ -128,307 +136,453 @@ LIST_FIXED_COUNT = 32
 TUPLE_FIXED_START = LIST_FIXED_START + LIST_FIXED_COUNT
 TUPLE_FIXED_COUNT = 32
 
-# Whether strings should be decoded when loading
-_decode_utf8 = True
+# Integer values of the typecodes, as read by indexing the payload.
+TYPE_TUPLE = ord(CHR_TUPLE)
+TYPE_LIST = ord(CHR_LIST)
+TYPE_DICT = ord(CHR_DICT)
+TYPE_INT = ord(CHR_INT)
+TYPE_INT1 = ord(CHR_INT1)
+TYPE_INT2 = ord(CHR_INT2)
+TYPE_INT4 = ord(CHR_INT4)
+TYPE_INT8 = ord(CHR_INT8)
+TYPE_FLOAT32 = ord(CHR_FLOAT32)
+TYPE_FLOAT64 = ord(CHR_FLOAT64)
+TYPE_TRUE = ord(CHR_TRUE)
+TYPE_FALSE = ord(CHR_FALSE)
+TYPE_NONE = ord(CHR_NONE)
+TYPE_TERM = ord(CHR_TERM)
+TYPE_SYMBOL = ord(CHR_SYMBOL)
+
+# The most strings a symbol table can hold.
+MAX_SYMBOLS = 256
+
+# Separator between the length and the body of a long string.
+TYPE_COLON = ord(b':')
+
+# Precompiled structs for the fixed width numbers.
+STRUCT_INT1 = struct.Struct('!b')
+STRUCT_INT2 = struct.Struct('!h')
+STRUCT_INT4 = struct.Struct('!l')
+STRUCT_INT8 = struct.Struct('!q')
+STRUCT_FLOAT32 = struct.Struct('!f')
+STRUCT_FLOAT64 = struct.Struct('!d')
+
+def _find(x, c, f, limit):
+    """Returns the index of the byte c in x, looking at no more than limit bytes from f."""
+    i = x.find(c, f, f + limit)
+    if i < 0:
+        raise ValueError('overflow')
+    return i
+
 
+# Every decoder takes the Decoder carrying the options, the buffer and
+# the offset of the typecode, and returns the value and the offset
+# following it. Containers count their nesting on the Decoder.
 
-def decode_int(x, f):
+def decode_int(d, x, f):
     f += 1
-    newf = x.index(CHR_TERM, f)
-    if newf - f >= MAX_INT_LENGTH:
-        raise ValueError('overflow')
-    try:
-        n = int(x[f:newf])
-    except (OverflowError, ValueError):
-        n = long(x[f:newf])
-    if x[f:f + 1] == '-':
-        if x[f + 1:f + 2] == '0':
+    newf = _find(x, TYPE_TERM, f, MAX_INT_LENGTH)
+    s = x[f:newf]
+    if s[:1] == b'-':
+        if s[1:2] == b'0':
             raise ValueError
-    elif x[f:f + 1] == '0' and newf != f + 1:
+    elif s[:1] == b'0' and newf != f + 1:
         raise ValueError
-    return (n, newf + 1)
+    return (int(s), newf + 1)
 
 
-def decode_intb(x, f):
-    f += 1
-    return (struct.unpack('!b', x[f:f + 1])[0], f + 1)
-
+def decode_intb(d, x, f):
+    return (STRUCT_INT1.unpack_from(x, f + 1)[0], f + 2)
 
-def decode_inth(x, f):
-    f += 1
-    return (struct.unpack('!h', x[f:f + 2])[0], f + 2)
 
+def decode_inth(d, x, f):
+    return (STRUCT_INT2.unpack_from(x, f + 1)[0], f + 3)
 
-def decode_intl(x, f):
-    f += 1
 
-    return (struct.unpack('!l', x[f:f + 4])[0], f + 4)
+def decode_intl(d, x, f):
+    return (STRUCT_INT4.unpack_from(x, f + 1)[0], f + 5)
 
 
-def decode_intq(x, f):
-    f += 1
-    return (struct.unpack('!q', x[f:f + 8])[0], f + 8)
+def decode_intq(d, x, f):
+    return (STRUCT_INT8.unpack_from(x, f + 1)[0], f + 9)
 
 
-def decode_float32(x, f):
-    f += 1
-    n = struct.unpack('!f', x[f:f + 4])[0]
-    return (n, f + 4)
+def decode_float32(d, x, f):
+    return (STRUCT_FLOAT32.unpack_from(x, f + 1)[0], f + 5)
 
 
-def decode_float64(x, f):
-    f += 1
-    n = struct.unpack('!d', x[f:f + 8])[0]
-    return (n, f + 8)
+def decode_float64(d, x, f):
+    return (STRUCT_FLOAT64.unpack_from(x, f + 1)[0], f + 9)
 
 
-def decode_string(x, f):
-    colon = x.index(b':', f)
-    try:
-        n = int(x[f:colon])
-    except (OverflowError, ValueError):
-        n = long(x[f:colon])
-    if x[f] == '0' and colon != f + 1:
+def decode_string(d, x, f):
+    colon = _find(x, TYPE_COLON, f, MAX_INT_LENGTH)
+    s = x[f:colon]
+    if s[:1] == b'0' and colon != f + 1:
         raise ValueError
     colon += 1
-    s = x[colon:colon + n]
-    if _decode_utf8:
-        s = s.decode('utf8')
-    return (s, colon + n)
+    end = colon + int(s)
+    if end > len(x):
+        raise ValueError
+    s = x[colon:end]
+    return (s.decode('utf8') if d.decode_utf8 else s, end)
 
 
-def decode_list(x, f):
+def decode_list(d, x, f):
+    d.depth += 1
+    if d.depth > d.max_depth:
+        raise ValueError('depth')
     r, f = [], f + 1
-    while x[f:f + 1] != CHR_TERM:
-        v, f = decode_func[x[f:f + 1]](x, f)
+    while x[f] != TYPE_TERM:
+        v, f = decode_func[x[f]](d, x, f)
         r.append(v)
+    d.depth -= 1
     return (r, f + 1)
 
-def decode_tuple(x, f):
-    r, f = [], f + 1
-    while x[f:f + 1] != CHR_TERM:
-        v, f = decode_func[x[f:f + 1]](x, f)
-        r.append(v)
-    return (tuple(r), f + 1)
+def decode_tuple(d, x, f):
+    r, f = decode_list(d, x, f)
+    return (tuple(r), f)
 
-def decode_dict(x, f):
+def decode_dict(d, x, f):
+    d.depth += 1
+    if d.depth > d.max_depth:
+        raise ValueError('depth')
     r, f = {}, f + 1
-    while x[f:f + 1] != CHR_TERM:
-        k, f = decode_func[x[f:f + 1]](x, f)
-        r[k], f = decode_func[x[f:f + 1]](x, f)
+    while x[f] != TYPE_TERM:
+        k, f = decode_func[x[f]](d, x, f)
+        r[k], f = decode_func[x[f]](d, x, f)
+    d.depth -= 1
     return (r, f + 1)
 
 
-def decode_true(x, f):
+def decode_true(d, x, f):
     return (True, f + 1)
 
 
-def decode_false(x, f):
+def decode_false(d, x, f):
     return (False, f + 1)
 
 
-def decode_none(x, f):
+def decode_none(d, x, f):
     return (None, f + 1)
 
+
+def decode_symbol(d, x, f):
+    return (d.symbols[x[f + 1]], f + 2)
+
+# Maps the integer typecode at the cursor to the function decoding it.
 decode_func = {}
-decode_func[b'0'] = decode_string
-decode_func[b'1'] = decode_string
-decode_func[b'2'] = decode_string
-decode_func[b'3'] = decode_string
-decode_func[b'4'] = decode_string
-decode_func[b'5'] = decode_string
-decode_func[b'6'] = decode_string
-decode_func[b'7'] = decode_string
-decode_func[b'8'] = decode_string
-decode_func[b'9'] = decode_string
-decode_func[CHR_TUPLE] = decode_tuple
-decode_func[CHR_LIST] = decode_list
-decode_func[CHR_DICT] = decode_dict
-decode_func[CHR_INT] = decode_int
-decode_func[CHR_INT1] = decode_intb
-decode_func[CHR_INT2] = decode_inth
-decode_func[CHR_INT4] = decode_intl
-decode_func[CHR_INT8] = decode_intq
-decode_func[CHR_FLOAT32] = decode_float32
-decode_func[CHR_FLOAT64] = decode_float64
-decode_func[CHR_TRUE] = decode_true
-decode_func[CHR_FALSE] = decode_false
-decode_func[CHR_NONE] = decode_none
+for c in b'0123456789':
+    decode_func[c] = decode_string
+decode_func[TYPE_TUPLE] = decode_tuple
+decode_func[TYPE_LIST] = decode_list
+decode_func[TYPE_DICT] = decode_dict
+decode_func[TYPE_INT] = decode_int
+decode_func[TYPE_INT1] = decode_intb
+decode_func[TYPE_INT2] = decode_inth
+decode_func[TYPE_INT4] = decode_intl
+decode_func[TYPE_INT8] = decode_intq
+decode_func[TYPE_FLOAT32] = decode_float32
+decode_func[TYPE_FLOAT64] = decode_float64
+decode_func[TYPE_TRUE] = decode_true
+decode_func[TYPE_FALSE] = decode_false
+decode_func[TYPE_NONE] = decode_none
+decode_func[TYPE_SYMBOL] = decode_symbol
+del c
 
 
 def make_fixed_length_string_decoders():
     def make_decoder(slen):
-        def f(x, f):
-            s = x[f + 1:f + 1 + slen]
-            if _decode_utf8:
-                s = s.decode("utf8")
-            return (s, f + 1 + slen)
+        def f(d, x, f):
+            f += 1
+            s = x[f:f + slen]
+            return (s.decode('utf8') if d.decode_utf8 else s, f + slen)
         return f
     for i in range(STR_FIXED_COUNT):
-        decode_func[int2byte(STR_FIXED_START + i)] = make_decoder(i)
+        decode_func[STR_FIXED_START + i] = make_decoder(i)
 
 make_fixed_length_string_decoders()
 
 
+# Small positive integers and short strings make up most of the leaves
+# of a message, so the fixed length containers decode them inline
+# rather than paying a decode_func call for each one. For the same
+# reason they only check the depth on entry, and count themselves
+# towards it once they hand an item to decode_func, which may recurse.
 def make_fixed_length_list_decoders():
-    def make_decoder(slen):
-        def f(x, f):
+    int_start, int_end = INT_POS_FIXED_START, INT_POS_FIXED_START + INT_POS_FIXED_COUNT
+    str_start, str_end = STR_FIXED_START, STR_FIXED_START + STR_FIXED_COUNT
+    def make_decoder(slen, as_tuple):
+        def f(d, x, f):
+            if d.depth >= d.max_depth:
+                raise ValueError('depth')
+            utf8 = d.decode_utf8
+            nested = False
             r, f = [], f + 1
             for _ in range(slen):
-                v, f = decode_func[x[f:f + 1]](x, f)
-                r.append(v)
-            return (list(r), f)
+                t = x[f]
+                if t < int_end:
+                    r.append(t - int_start)
+                    f += 1
+                elif str_start <= t < str_end and utf8:
+                    t -= str_start - 1
+                    r.append(x[f + 1:f + t].decode('utf8'))
+                    f += t
+                else:
+                    if not nested:
+                        nested = True
+                        d.depth += 1
+                    v, f = decode_func[t](d, x, f)
+                    r.append(v)
+            if nested:
+                d.depth -= 1
+            return (tuple(r) if as_tuple else r, f)
         return f
     for i in range(LIST_FIXED_COUNT):
-        decode_func[int2byte(LIST_FIXED_START + i)] = make_decoder(i)
-
-make_fixed_length_list_decoders()
-
-def make_fixed_length_tuple_decoders():
-    def make_decoder(slen):
-        def f(x, f):
-            r, f = [], f + 1
-            for _ in range(slen):
-                v, f = decode_func[x[f:f + 1]](x, f)
-                r.append(v)
-            return (tuple(r), f)
-        return f
+        decode_func[LIST_FIXED_START + i] = make_decoder(i, False)
     for i in range(TUPLE_FIXED_COUNT):
-        decode_func[int2byte(TUPLE_FIXED_START + i)] = make_decoder(i)
+        decode_func[TUPLE_FIXED_START + i] = make_decoder(i, True)
 
-make_fixed_length_tuple_decoders()
+make_fixed_length_list_decoders()
 
 def make_fixed_length_int_decoders():
     def make_decoder(j):
-        def f(x, f):
+        def f(d, x, f):
             return (j, f + 1)
         return f
     for i in range(INT_POS_FIXED_COUNT):
-        decode_func[int2byte(INT_POS_FIXED_START + i)] = make_decoder(i)
+        decode_func[INT_POS_FIXED_START + i] = make_decoder(i)
     for i in range(INT_NEG_FIXED_COUNT):
-        decode_func[int2byte(INT_NEG_FIXED_START + i)] = make_decoder(-1 - i)
+        decode_func[INT_NEG_FIXED_START + i] = make_decoder(-1 - i)
 
 make_fixed_length_int_decoders()
 
 
 def make_fixed_length_dict_decoders():
+    int_start, int_end = INT_POS_FIXED_START, INT_POS_FIXED_START + INT_POS_FIXED_COUNT
+    str_start, str_end = STR_FIXED_START, STR_FIXED_START + STR_FIXED_COUNT
     def make_decoder(slen):
-        def f(x, f):
+        def f(d, x, f):
+            if d.depth >= d.max_depth:
+                raise ValueError('depth')
+            utf8 = d.decode_utf8
+            nested = False
             r, f = {}, f + 1
             for _ in range(slen):
-                k, f = decode_func[x[f:f + 1]](x, f)
-                r[k], f = decode_func[x[f:f + 1]](x, f)
+                t = x[f]
+                if str_start <= t < str_end and utf8:
+                    t -= str_start - 1
+                    k = x[f + 1:f + t].decode('utf8')
+                    f += t
+                else:
+                    if not nested:
+                        nested = True
+                        d.depth += 1
+                    k, f = decode_func[t](d, x, f)
+                t = x[f]
+                if t < int_end:
+                    r[k] = t - int_start
+                    f += 1
+                elif str_start <= t < str_end and utf8:
+                    t -= str_start - 1
+                    r[k] = x[f + 1:f + t].decode('utf8')
+                    f += t
+                else:
+                    if not nested:
+                        nested = True
+                        d.depth += 1
+                    r[k], f = decode_func[t](d, x, f)
+            if nested:
+                d.depth -= 1
             return (r, f)
         return f
     for i in range(DICT_FIXED_COUNT):
-        decode_func[int2byte(DICT_FIXED_START + i)] = make_decoder(i)
+        decode_func[DICT_FIXED_START + i] = make_decoder(i)
 
 make_fixed_length_dict_decoders()
 
 
+class Decoder(object):
+    """
+    Loads data structures, with the decoding options kept on the instance.
+
+    Nothing is shared between instances, so one can be kept per channel
+    or per thread. A decoder tracks its nesting depth while loading, so
+    a single instance must not be used from two threads at once.
+    """
+    def __init__(self, decode_utf8=True, max_depth=DEFAULT_MAX_DEPTH, max_length=None, symbols=()):
+        # Whether strings should be decoded when loading.
+        self.decode_utf8 = decode_utf8
+        # The strings of the symbol table by index, interned so every
+        # message shares the same objects.
+        if not symbols:
+            self.symbols = ()
+        elif decode_utf8:
+            self.symbols = tuple(intern(s) for s in check_symbols(symbols))
+        else:
+            self.symbols = tuple(s.encode("utf8") for s in check_symbols(symbols))
+        # The deepest nesting of containers accepted.
+        self.max_depth = max_depth
+        # The longest payload accepted in bytes, or None for no limit.
+        self.max_length = max_length
+        # The nesting depth of the container being decoded.
+        self.depth = 0
+
+    def loads(self, x):
+        """
+        Load data structure from any bytes-like object.
+
+        The payload is walked with an integer offset, reading typecodes
+        by indexing, so only the decoded objects themselves are
+        allocated. Any other bytes-like object is copied to bytes once
+        up front, as slicing and decoding bytes is cheaper than going
+        through a memoryview for each string.
+        """
+        if type(x) is not bytes:
+            x = memoryview(x).tobytes()
+        if self.max_length is not None and len(x) > self.max_length:
+            raise ValueError('Payload (%d bytes) is longer than %d' % (len(x), self.max_length))
+        self.depth = 0
+        try:
+            r, l = decode_func[x[0]](self, x, 0)
+        except (IndexError, KeyError, struct.error):
+            raise ValueError
+        if l != len(x):
+            raise ValueError
+        return r
+
+
+# The codecs behind loads and dumps, made once per thread for each
+# option rather than on every call. They track their nesting depth,
+# so each thread needs its own.
+_codecs = threading.local()
+
+
+def _codec(cls, option):
+    codec = _codecs.__dict__.get((cls, option))
+    if codec is None:
+        codec = _codecs.__dict__[(cls, option)] = cls(option)
+    return codec
+
+
 def loads(x, decode_utf8=True):
-    global _decode_utf8
-    _decode_utf8 = decode_utf8
-    try:
-        r, l = decode_func[x[0:1]](x, 0)
-    except (IndexError, KeyError):
-        raise ValueError
-    if l != len(x):
-        raise ValueError
-    return r
+    return _codec(Decoder, decode_utf8).loads(x)
 
 
-def encode_int(x, r):
+# Every encoder takes the Encoder carrying the options, the value and
+# the bytearray to append to. Containers count their nesting on the
+# Encoder.
+
+def encode_int(e, x, r):
     if 0 <= x < INT_POS_FIXED_COUNT:
-        r.append(int2byte(INT_POS_FIXED_START + x))
+        r.append(INT_POS_FIXED_START + x)
     elif -INT_NEG_FIXED_COUNT <= x < 0:
-        r.append(int2byte(INT_NEG_FIXED_START - 1 - x))
+        r.append(INT_NEG_FIXED_START - 1 - x)
     elif -128 <= x < 128:
-        r.extend((CHR_INT1, struct.pack('!b', x)))
+        r.append(TYPE_INT1)
+        r += STRUCT_INT1.pack(x)
     elif -32768 <= x < 32768:
-        r.extend((CHR_INT2, struct.pack('!h', x)))
+        r.append(TYPE_INT2)
+        r += STRUCT_INT2.pack(x)
     elif -2147483648 <= x < 2147483648:
-        r.extend((CHR_INT4, struct.pack('!l', x)))
+        r.append(TYPE_INT4)
+        r += STRUCT_INT4.pack(x)
     elif -9223372036854775808 <= x < 9223372036854775808:
-        r.extend((CHR_INT8, struct.pack('!q', x)))
+        r.append(TYPE_INT8)
+        r += STRUCT_INT8.pack(x)
     else:
-        s = str(x)
-        if py3:
-            s = bytes(s, "ascii")
-
+        s = b'%d' % x
         if len(s) >= MAX_INT_LENGTH:
             raise ValueError('overflow')
-        r.extend((CHR_INT, s, CHR_TERM))
-
-
-def encode_float32(x, r):
-    r.extend((CHR_FLOAT32, struct.pack('!f', x)))
+        r.append(TYPE_INT)
+        r += s
+        r.append(TYPE_TERM)
 
 
-def encode_float64(x, r):
-    r.extend((CHR_FLOAT64, struct.pack('!d', x)))
+def encode_float(e, x, r):
+    if e.float_bits == 32:
+        r.append(TYPE_FLOAT32)
+        r += STRUCT_FLOAT32.pack(x)
+    else:
+        r.append(TYPE_FLOAT64)
+        r += STRUCT_FLOAT64.pack(x)
 
 
-def encode_bool(x, r):
-    r.append({False: CHR_FALSE, True: CHR_TRUE}[bool(x)])
+def encode_bool(e, x, r):
+    r.append(TYPE_TRUE if x else TYPE_FALSE)
 
 
-def encode_none(x, r):
-    r.append(CHR_NONE)
+def encode_none(e, x, r):
+    r.append(TYPE_NONE)
 
 
-def encode_string(x, r):
+def encode_string(e, x, r):
     if len(x) < STR_FIXED_COUNT:
-        r.extend((int2byte(STR_FIXED_START + len(x)), x))
+        r.append(STR_FIXED_START + len(x))
     else:
-        s = str(len(x))
-        if py3:
-            s = bytes(s, "ascii")
-        r.extend((s, b':', x))
+        r += b'%d:' % len(x)
+    r += x
 
 
-def encode_unicode(x, r):
-    encode_string(x.encode("utf8"), r)
+def encode_unicode(e, x, r):
+    if x in e.codes:
+        r.append(TYPE_SYMBOL)
+        r.append(e.codes[x])
+    else:
+        encode_string(e, x.encode("utf8"), r)
 
 
-def encode_list(x, r):
+def encode_list(e, x, r):
+    e.depth += 1
+    if e.depth > e.max_depth:
+        raise ValueError('depth')
     if len(x) < LIST_FIXED_COUNT:
-        r.append(int2byte(LIST_FIXED_START + len(x)))
+        r.append(LIST_FIXED_START + len(x))
         for i in x:
-            encode_func[type(i)](i, r)
+            encode_func[type(i)](e, i, r)
     else:
-        r.append(CHR_LIST)
+        r.append(TYPE_LIST)
         for i in x:
-            encode_func[type(i)](i, r)
-        r.append(CHR_TERM)
-
-def encode_tuple(x, r):
+            encode_func[type(i)](e, i, r)
+        r.append(TYPE_TERM)
+    e.depth -= 1
+
+def encode_tuple(e, x, r):
+    e.depth += 1
+    if e.depth > e.max_depth:
+        raise ValueError('depth')
     if len(x) < TUPLE_FIXED_COUNT:
-        r.append(int2byte(TUPLE_FIXED_START + len(x)))
+        r.append(TUPLE_FIXED_START + len(x))
         for i in x:
-            encode_func[type(i)](i, r)
+            encode_func[type(i)](e, i, r)
     else:
-        r.append(CHR_TUPLE)
+        r.append(TYPE_TUPLE)
         for i in x:
-            encode_func[type(i)](i, r)
-        r.append(CHR_TERM)
-
-def encode_dict(x, r):
+            encode_func[type(i)](e, i, r)
+        r.append(TYPE_TERM)
+    e.depth -= 1
+
+def encode_dict(e, x, r):
+    e.depth += 1
+    if e.depth > e.max_depth:
+        raise ValueError('depth')
     if len(x) < DICT_FIXED_COUNT:
-        r.append(int2byte(DICT_FIXED_START + len(x)))
+        r.append(DICT_FIXED_START + len(x))
         for k, v in x.items():
-            encode_func[type(k)](k, r)
-            encode_func[type(v)](v, r)
+            encode_func[type(k)](e, k, r)
+            encode_func[type(v)](e, v, r)
     else:
-        r.append(CHR_DICT)
+        r.append(TYPE_DICT)
         for k, v in x.items():
-            encode_func[type(k)](k, r)
-            encode_func[type(v)](v, r)
-        r.append(CHR_TERM)
+            encode_func[type(k)](e, k, r)
+            encode_func[type(v)](e, v, r)
+        r.append(TYPE_TERM)
+    e.depth -= 1
 
 encode_func = {}
 encode_func[int] = encode_int
 encode_func[long] = encode_int
+encode_func[float] = encode_float
 encode_func[bytes] = encode_string
 encode_func[list] = encode_list
 encode_func[tuple] = encode_tuple
@@ -437,7 +591,91 @@ encode_func[type(None)] = encode_none
 encode_func[unicode] = encode_unicode
 encode_func[bool] = encode_bool
 
-lock = Lock()
+
+class Encoder(object):
+    """
+    Dumps data structures, with the encoding options kept on the instance.
+
+    Nothing is shared between instances, so one can be kept per channel
+    or per thread. An encoder tracks its nesting depth while dumping, so
+    a single instance must not be used from two threads at once.
+    """
+    def __init__(self, float_bits=DEFAULT_FLOAT_BITS, max_depth=DEFAULT_MAX_DEPTH, max_length=None, symbols=()):
+        if float_bits not in (32, 64):
+            raise ValueError('Float bits (%d) is not 32 or 64' % float_bits)
+        # The number of bits for serialized floats.
+        self.float_bits = float_bits
+        # The index of each string in the symbol table.
+        self.codes = dict((s, i) for i, s in enumerate(check_symbols(symbols))) if symbols else {}
+        # The deepest nesting of containers accepted.
+        self.max_depth = max_depth
+        # The longest payload produced in bytes, or None for no limit.
+        self.max_length = max_length
+        # The nesting depth of the container being encoded.
+        self.depth = 0
+
+    def dumps(self, x):
+        """
+        Dump data structure to bytes.
+
+        The encoding is written into a single growing bytearray.
+        """
+        self.depth = 0
+        r = bytearray()
+        encode_func[type(x)](self, x, r)
+        if self.max_length is not None and len(r) > self.max_length:
+            raise ValueError('Payload (%d bytes) is longer than %d' % (len(r), self.max_length))
+        return bytes(r)
+
+    def dumps_items(self, x):
+        """
+        Dump the items of dict x without the dict around them.
+
+        Returns the item count and their encoding, to be passed to
+        dumps_merged, so a body shared by many messages is encoded once.
+        """
+        self.depth = 1
+        r = bytearray()
+        for k, v in x.items():
+            encode_func[type(k)](self, k, r)
+            encode_func[type(v)](self, v, r)
+        return (len(x), bytes(r))
+
+    def dumps_merged(self, items, x):
+        """
+        Dump the dict made of the items from dumps_items and those of dict x.
+
+        The keys of x must not repeat any of the pre-encoded keys.
+        """
+        count, body = items
+        count += len(x)
+        self.depth = 1
+        r = bytearray()
+        r.append(DICT_FIXED_START + count if count < DICT_FIXED_COUNT else TYPE_DICT)
+        r += body
+        for k, v in x.items():
+            encode_func[type(k)](self, k, r)
+            encode_func[type(v)](self, v, r)
+        if count >= DICT_FIXED_COUNT:
+            r.append(TYPE_TERM)
+        if self.max_length is not None and len(r) > self.max_length:
+            raise ValueError('Payload (%d bytes) is longer than %d' % (len(r), self.max_length))
+        return bytes(r)
+
+
+def check_symbols(symbols):
+    """
+    Return symbols as a tuple, checking it is a valid symbol table.
+
+    A symbol table is a sequence of distinct strings, which both ends
+    must agree on, whose members are sent as a typecode and an index.
+    """
+    symbols = tuple(symbols)
+    if len(symbols) > MAX_SYMBOLS:
+        raise ValueError('Too many symbols (%d), the most is %d' % (len(symbols), MAX_SYMBOLS))
+    if not all(type(s) is unicode for s in symbols) or len(set(symbols)) != len(symbols):
+        raise ValueError('Symbols must be distinct strings')
+    return symbols
 
 
 def dumps(x, float_bits=DEFAULT_FLOAT_BITS):
@@ -446,16 +684,7 @@ def dumps(x, float_bits=DEFAULT_FLOAT_BITS):
 
     Here float_bits is either 32 or 64.
     """
-    with lock:
-        if float_bits == 32:
-            encode_func[float] = encode_float32
-        elif float_bits == 64:
-            encode_func[float] = encode_float64
-        else:
-            raise ValueError('Float bits (%d) is not 32 or 64' % float_bits)
-        r = []
-        encode_func[type(x)](x, r)
-    return b''.join(r)
+    return _codec(Encoder, float_bits).dumps(x)
 
 
 def test():
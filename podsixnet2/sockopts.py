@@ -0,0 +1,89 @@
+"""
+Socket setup shared by every transport, so listening, accepted and connecting sockets are set up the same way.
+
+Addresses are either (host, port) tuples for TCP, or strings of the form "unix:/path" for Unix domain sockets,
+which save local bots and tools the work of the TCP stack. Tuning options the platform doesn't have are skipped.
+"""
+
+import errno
+import os
+import socket
+import stat
+
+def TuneSocket(sock, sendbuffer=None, recvbuffer=None, keepalive=None):
+    """Sets the send and receive buffer sizes in bytes, and turns on TCP keepalive probes after keepalive seconds idle.
+    Options left as None keep the system defaults. Set on a listening socket, they are inherited by the sockets it accepts."""
+    options = []
+    if sendbuffer:
+        options.append((socket.SOL_SOCKET, socket.SO_SNDBUF, sendbuffer))
+    if recvbuffer:
+        options.append((socket.SOL_SOCKET, socket.SO_RCVBUF, recvbuffer))
+    if keepalive:
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, keepalive))
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, keepalive // 4)))
+        elif hasattr(socket, "TCP_KEEPALIVE"):
+            # macOS names the idle time TCP_KEEPALIVE
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, keepalive))
+    for level, option, value in options:
+        try:
+            sock.setsockopt(level, option, value)
+        except socket.error:
+            pass
+
+def ParseAddress(address):
+    """Returns the socket family and the address in the form that family's sockets take."""
+    if isinstance(address, str) and address.startswith("unix:"):
+        if not hasattr(socket, "AF_UNIX"):
+            raise ValueError("Unix domain sockets are not available on this platform")
+        return socket.AF_UNIX, address[len("unix:"):]
+    return socket.AF_INET, address
+
+def Listen(address, listeners=socket.SOMAXCONN, reuseport=False, sendbuffer=None, recvbuffer=None, keepalive=None):
+    """Returns a non-blocking socket listening on the address, tuned before it listens so the sockets it accepts inherit the options.
+    A Unix domain socket file left behind by a server which is no longer running is replaced."""
+    family, sockaddr = ParseAddress(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        TuneSocket(sock, sendbuffer, recvbuffer, keepalive)
+        if family == socket.AF_INET:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if reuseport:
+                ReusePort(sock)
+        else:
+            _RemoveStale(sockaddr)
+        sock.bind(sockaddr)
+        sock.listen(listeners)
+        sock.setblocking(False)
+    except:
+        sock.close()
+        raise
+    return sock
+
+def _RemoveStale(path):
+    """Removes the socket file at path if nothing is listening on it any more. Raises an error if path is some other kind of file."""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(errno.EEXIST, "not a socket", path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except socket.error as e:
+        if e.errno == errno.ECONNREFUSED:
+            os.unlink(path)
+    finally:
+        probe.close()
+
+def ReusePort(sock):
+    """Lets other sockets bind the same address and port, so several processes can share the listening, or a restarted server can
+    listen before the old one has let go. Must be set before binding."""
+    if hasattr(socket, "SO_REUSEPORT"):
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        except socket.error:
+            pass
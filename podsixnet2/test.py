@@ -5,11 +5,61 @@ import unittest
 import sys
 from time import sleep, time
 import socket
+import threading
+import os
+import signal
+import tempfile
 
-from podsixnet2.asyncwrapper import poll, asyncore
+from podsixnet2.asyncwrapper import poll, asyncore, SelectorMap
 from podsixnet2.Server import Server
 from podsixnet2.Channel import Channel
 from podsixnet2.EndPoint import EndPoint
+from podsixnet2.rencode import loads, dumps, Encoder, Decoder
+from podsixnet2 import aio
+from podsixnet2.Supervisor import Supervisor
+from podsixnet2.Base import handles, Dispatch
+from podsixnet2.Loopback import LoopbackEndPoint
+
+class RencodeTestCase(unittest.TestCase):
+    messages = [
+        {"action": "hand_and_stats", "hand": ["Ah", "2c", "Td", "Kh"], "stats": [(4, ("A", "K")), (5, ())], "deck": 30},
+        {"action": "ask", "player": 1, "rank": "K"},
+        {"action": "hello", "data": [10] * 512, "x": [0, "---", -5, 300, 2 ** 40, 2 ** 70, 1.5, None, True], "y": "zäö" * 30},
+    ]
+    
+    def runTest(self):
+        for message in self.messages:
+            encoded = dumps(message)
+            # the decoder reads any buffer in place
+            for buffer in (encoded, bytearray(encoded), memoryview(encoded)):
+                self.assertEqual(loads(buffer), message)
+            self.assertEqual(loads(encoded, decode_utf8=False)[b"action"], message["action"].encode())
+            self.assertRaises(ValueError, loads, encoded[:-1])
+            self.assertRaises(ValueError, loads, encoded + b"\0")
+        # the float width is chosen per call
+        self.assertEqual(loads(dumps([1.1], 64)), [1.1])
+        self.assertNotEqual(loads(dumps([1.1], 32)), [1.1])
+        self.assertRaises(ValueError, dumps, 1.1, 16)
+        # limits are per instance
+        nested = [[[["deep"]]]]
+        self.assertEqual(Decoder(max_depth=4).loads(dumps(nested)), nested)
+        self.assertRaises(ValueError, Decoder(max_depth=3).loads, dumps(nested))
+        self.assertRaises(ValueError, Decoder(max_length=8).loads, dumps(nested))
+        self.assertRaises(ValueError, Encoder(max_depth=3).dumps, nested)
+        self.assertEqual(Decoder(decode_utf8=False).loads(Encoder(64).dumps(nested)), [[[[b"deep"]]]])
+        cyclic = []
+        cyclic.append(cyclic)
+        self.assertRaises(ValueError, dumps, cyclic)
+        # strings in a symbol table are sent as codes, and decode to the table's own objects
+        symbols = ["action", "hand_and_stats", "hand", "Ah"]
+        message = self.messages[0]
+        encoded = Encoder(symbols=symbols).dumps(message)
+        self.assertTrue(len(encoded) < len(dumps(message)))
+        self.assertEqual(Decoder(symbols=symbols).loads(encoded), message)
+        self.assertIs(list(Decoder(symbols=symbols).loads(encoded))[0], Decoder(symbols=symbols).symbols[0])
+        self.assertRaises(ValueError, loads, encoded)
+        self.assertRaises(ValueError, Encoder, symbols=["x"] * 2)
+        self.assertRaises(ValueError, Decoder, symbols=[str(i) for i in range(257)])
 
 class FailEndPointTestCase(unittest.TestCase):
     def setUp(self):
@@ -45,7 +95,7 @@ class EndPointTestCase(unittest.TestCase):
             {"action": "hello", "data": {"a": 321, "b": [2, 3, 4], "c": ["afw", "wafF", "aa", "weEEW", "w234r"], "d": ["x"] * 256}},
             {"action": "hello", "data": [454, 35, 43, 543, "aabv"]},
             {"action": "hello", "data": [10] * 512},
-            #{"action": "hello", "data": [10] * 512, "otherstuff": "hello\0---\0goodbye", "x": [0, "---", 0], "y": "zÃ¤Ã¶"},
+            {"action": "hello", "data": [10] * 512, "otherstuff": "hello\0---\0goodbye", "x": [0, "---", 0], "y": "zÃ¤Ã¶"},
         ]
         self.count = len(self.outgoing)
         self.lengths = [len(data['data']) for data in self.outgoing]
@@ -67,7 +117,7 @@ class EndPointTestCase(unittest.TestCase):
             def Network_gotit(self, data):
                 self.received.append(data)
                 self.count += 1
-                
+        
         
         class TestServer(Server):
             connected = False
@@ -107,14 +157,917 @@ class EndPointTestCase(unittest.TestCase):
         
         self.assertTrue(self.server.count == self.count, "Didn't receive the right number of messages")
         self.assertTrue(self.endpoint.count == self.count, "Didn't receive the right number of messages")
+        self.assertEqual(self.endpoint._oframing, "length", "Endpoint did not switch to length framing")
+        self.assertEqual(self.server.channels[0]._iframing, "length", "Server did not switch to length framing")
+        
+        self.endpoint.Close()
+    
+    
+    def tearDown(self):
+        del self.server
+        del self.endpoint
+
+class LargeMessageTestCase(unittest.TestCase):
+    """ Messages bigger than the receive buffer grow it, messages bigger than maxmessagesize are refused. """
+    def setUp(self):
+        class ServerChannel(Channel):
+            maxmessagesize = 1 << 18
+            def Network_big(self, data):
+                self._server.received.append(len(data["data"]))
+            def Close(self):
+                self._server.closed = True
+        
+        class TestServer(Server):
+            received = []
+            closed = False
+        
+        self.server = TestServer(channelClass=ServerChannel, localaddr=("127.0.0.1", 31430))
+        self.endpoint = EndPoint(("127.0.0.1", 31430))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for size in (10, 100000, 200000, 10):
+            self.endpoint.Send({"action": "big", "data": "x" * size})
+        for x in range(500):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if len(self.server.received) == 4:
+                break
+            sleep(0.001)
+        self.assertEqual(self.server.received, [10, 100000, 200000, 10])
+        self.assertFalse(self.server.closed)
+        
+        self.endpoint.Send({"action": "big", "data": "x" * 300000})
+        for x in range(500):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.closed:
+                break
+            sleep(0.001)
+        self.assertTrue(self.server.closed, "Oversized message did not close the channel")
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class BroadcastTestCase(unittest.TestCase):
+    """ Broadcasts are encoded once and reach every channel. """
+    def setUp(self):
+        class TestEndPoint(EndPoint):
+            def Network_news(self, data):
+                self.received.append(data)
+        
+        self.server = Server(localaddr=("127.0.0.1", 31431))
+        self.endpoints = [TestEndPoint(("127.0.0.1", 31431)) for x in range(3)]
+        for e in self.endpoints:
+            e.received = []
+            e.DoConnect()
+    
+    def runTest(self):
+        for x in range(100):
+            self.server.Pump()
+            [e.Pump() for e in self.endpoints]
+            if len(self.server.channels) == 3:
+                break
+            sleep(0.001)
+        channels = self.server.channels
+        self.server.Broadcast({"action": "news", "all": True})
+        self.assertTrue(all(c.sendqueue[-1] is channels[0].sendqueue[-1] for c in channels))
+        self.server.Broadcast({"action": "news", "all": False}, recipients=channels[:1])
+        self.server.BroadcastEach({"action": "news", "shared": list(range(40))}, {c: {"mine": i} for i, c in enumerate(channels)})
+        for x in range(100):
+            self.server.Pump()
+            [e.Pump() for e in self.endpoints]
+            if all(len(e.received) >= 2 for e in self.endpoints) and len(self.endpoints[0].received) == 3:
+                break
+            sleep(0.001)
+        self.assertEqual(sorted(len(e.received) for e in self.endpoints), [2, 2, 3])
+        for e in self.endpoints:
+            self.assertEqual(e.received[0], {"action": "news", "all": True})
+            self.assertEqual(e.received[-1]["shared"], list(range(40)))
+        self.assertEqual(sorted(e.received[-1]["mine"] for e in self.endpoints), [0, 1, 2])
+    
+    def tearDown(self):
+        [e.Close() for e in self.endpoints]
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+class CoalesceTestCase(unittest.TestCase):
+    """ Everything queued between pumps goes out in a single send. """
+    def setUp(self):
+        class CorkedChannel(Channel):
+            cork = True
+            sends = 0
+            def send(self, data):
+                self.sends += 1
+                return Channel.send(self, data)
         
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network_turn(self, data):
+                self.received.append(data["n"])
+        
+        self.server = Server(channelClass=CorkedChannel, localaddr=("127.0.0.1", 31432))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31432))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.channels and self.server.channels[0]._iframing == "length":
+                break
+            sleep(0.001)
+        channel = self.server.channels[0]
+        channel.sends = 0
+        for n in range(10):
+            channel.Send({"action": "turn", "n": n})
+        channel.Pump()
+        self.assertEqual(channel.sends, 1)
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if len(self.endpoint.received) == 10:
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, list(range(10)))
+    
+    def tearDown(self):
         self.endpoint.Close()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class BackpressureTestCase(unittest.TestCase):
+    """ A congested channel replaces superseded messages, drops non-critical ones, and is closed once it overflows. """
+    def setUp(self):
+        class StateChannel(Channel):
+            highwater = 1000
+            lowwater = 200
+            maxpending = 4000
+            superseded = ("state",)
+            noncritical = ("chat",)
+        
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network_state(self, data):
+                self.received.append(data["n"])
+            def Network_chat(self, data):
+                self.received.append("chat")
         
+        self.server = Server(channelClass=StateChannel, localaddr=("127.0.0.1", 31433))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31433))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.channels and self.server.channels[0]._iframing == "length":
+                break
+            sleep(0.001)
+        channel = self.server.channels[0]
+        # nothing is written until the next pump, so the queue stands in for a client which isn't reading
+        for n in range(50):
+            channel.Send({"action": "state", "n": n, "padding": "x" * 100})
+        self.assertTrue(channel.congested)
+        self.assertEqual(channel.Send({"action": "chat"}), 0)
+        self.assertTrue(channel.PendingBytes() < channel.highwater + 200)
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.endpoint.received and self.endpoint.received[-1] == 49:
+                break
+            sleep(0.001)
+        received = self.endpoint.received
+        self.assertEqual(received[-1], 49)
+        self.assertEqual(received, sorted(received))
+        self.assertEqual(channel.droppedmessages, 50 - len(received) + 1)
+        # the channel notices the write has gone out on its next pump
+        self.server.Pump()
+        self.assertFalse(channel.congested)
+        # anything else piles up until the channel gives up on the client
+        for n in range(50):
+            channel.Send({"action": "turn", "n": n, "padding": "x" * 100})
+        self.assertTrue(channel.overflowed)
+        self.server.Pump()
+        self.assertFalse(channel.connected)
     
     def tearDown(self):
+        self.endpoint.Close()
+        self.server.close()
         del self.server
         del self.endpoint
 
+class SupersedeDeltaTestCase(unittest.TestCase):
+    """ A congested channel's new snapshot replaces the older snapshot and the changes to it still queued. """
+    def setUp(self):
+        class StateChannel(Channel):
+            highwater = 1000
+            lowwater = 200
+            superseded = ("state",)
+            supersedes = {"state": ("state", "delta")}
+        
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network(self, data):
+                self.received.append((data["action"], data.get("n")))
+        
+        self.server = Server(channelClass=StateChannel, localaddr=("127.0.0.1", 31448))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31448))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.channels and self.server.channels[0]._iframing == "length":
+                break
+            sleep(0.001)
+        channel = self.server.channels[0]
+        del self.endpoint.received[:]
+        for action, n in (("state", 1), ("delta", 2), ("delta", 3)):
+            channel.Send({"action": action, "n": n})
+        channel.Send({"action": "turn", "padding": "x" * 1000})
+        self.assertTrue(channel.congested)
+        # changes made to the new snapshot are kept
+        channel.Send({"action": "state", "n": 4})
+        channel.Send({"action": "delta", "n": 5})
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.endpoint.received and self.endpoint.received[-1] == ("delta", 5):
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, [("turn", None), ("state", 4), ("delta", 5)])
+        self.assertEqual(channel.droppedmessages, 3)
+    
+    def tearDown(self):
+        self.endpoint.Close()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class PauseTestCase(unittest.TestCase):
+    """ Non-critical messages paused while congested are sent once the client catches up, however many there are. """
+    def setUp(self):
+        class PausingChannel(Channel):
+            highwater = 1000
+            lowwater = 200
+            backpressure = "pause"
+            noncritical = ("chat",)
+        
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network_chat(self, data):
+                self.received.append(data["n"])
+        
+        self.server = Server(channelClass=PausingChannel, localaddr=("127.0.0.1", 31446))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31446))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.channels and self.server.channels[0]._iframing == "length":
+                break
+            sleep(0.001)
+        channel = self.server.channels[0]
+        channel.Send({"action": "turn", "padding": "x" * 1000})
+        self.assertTrue(channel.congested)
+        # more is paused than the channel recovers at
+        for n in range(6):
+            channel.Send({"action": "chat", "n": n, "padding": "x" * 80})
+        self.assertTrue(len(channel.pausedqueue) == 6 and channel._pausedbytes > channel.lowwater)
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if len(self.endpoint.received) == 6:
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, list(range(6)))
+        self.server.Pump()
+        self.assertFalse(channel.congested)
+        self.assertEqual(channel.pausedqueue, [])
+    
+    def tearDown(self):
+        self.endpoint.Close()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class SupersedeTestCase(unittest.TestCase):
+    """ Only the latest of several state snapshots received in one pump is read from the queue. """
+    def setUp(self):
+        class TestEndPoint(EndPoint):
+            supersedes = {"state": ("state", "delta"), "delta": ()}
+        
+        self.server = Server(localaddr=("127.0.0.1", 31434))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31434))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.server.channels and self.server.channels[0]._iframing == "length":
+                break
+            sleep(0.001)
+        channel = self.server.channels[0]
+        for action, n in (("state", 1), ("delta", 2), ("turn", 3), ("state", 4), ("delta", 5), ("delta", 6)):
+            channel.Send({"action": action, "n": n})
+        channel.Pump()
+        for x in range(100):
+            self.endpoint.Pump()
+            if self.endpoint.queue:
+                break
+            sleep(0.001)
+        self.assertEqual([d["n"] for d in self.endpoint.queue], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([d["n"] for d in self.endpoint.GetQueue()], [3, 4, 5, 6])
+        self.assertEqual(len(self.endpoint.GetQueue({})), 6)
+    
+    def tearDown(self):
+        self.endpoint.Close()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class SelectorMapTestCase(unittest.TestCase):
+    """ Idle sockets stay registered for reading only, and a socket is watched for writing just while its output is backed up. """
+    def setUp(self):
+        self.server = Server(localaddr=("127.0.0.1", 31437), listeners=20)
+        self.endpoints = [EndPoint(("127.0.0.1", 31437)) for x in range(20)]
+    
+    def runTest(self):
+        self.assertTrue(isinstance(self.server._map, SelectorMap))
+        [endpoint.DoConnect() for endpoint in self.endpoints]
+        for x in range(200):
+            self.server.Pump()
+            [endpoint.Pump() for endpoint in self.endpoints]
+            if len(self.server.channels) == 20 and all(endpoint._iframing == "length" for endpoint in self.endpoints):
+                break
+            sleep(0.001)
+        self.assertEqual(len(self.server.channels), 20)
+        self.server.Pump()
+        self.assertEqual(self.server._map._writing, set())
+        # more than the socket buffers hold, so some of it waits for the endpoint to read
+        channel = self.server.channels[0]
+        channel.Send({"action": "big", "data": "x" * (1 << 19)})
+        channel.Pump()
+        self.server.Pump()
+        self.assertEqual(self.server._map._writing, {channel._fileno})
+        for x in range(200):
+            self.server.Pump()
+            [endpoint.Pump() for endpoint in self.endpoints]
+            if not channel.producer_fifo:
+                break
+            sleep(0.001)
+        self.server.Pump()
+        self.assertEqual(self.server._map._writing, set())
+    
+    def tearDown(self):
+        [endpoint.Close() for endpoint in self.endpoints]
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+class ServeForeverTestCase(unittest.TestCase):
+    """ A pump sleeps until I/O arrives or a timer is due, and serving forever stops when asked. """
+    def setUp(self):
+        self.server = Server(localaddr=("127.0.0.1", 31438))
+        self.endpoint = EndPoint(("127.0.0.1", 31438))
+    
+    def runTest(self):
+        fired = []
+        self.server.CallLater(0.02, fired.append, 1)
+        self.server.CallLater(0.01, fired.append, 2).cancel()
+        start = time()
+        self.server.Pump(5)
+        self.assertEqual(fired, [1])
+        self.assertTrue(time() - start < 1)
+        # an incoming connection wakes the pump too
+        self.endpoint.DoConnect()
+        start = time()
+        self.server.Pump(5)
+        self.assertEqual(len(self.server.channels), 1)
+        self.assertTrue(time() - start < 1)
+        self.server.CallLater(0.01, fired.append, 3)
+        self.server.CallLater(0.02, self.server.Stop)
+        self.server.ServeForever()
+        self.assertEqual(fired, [1, 3])
+        self.assertFalse(self.server.serving)
+    
+    def tearDown(self):
+        self.endpoint.Close()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class SupervisorTestCase(unittest.TestCase):
+    """ A supervisor hands connections to its workers in groups, and the workers finish when it is interrupted. """
+    def setUp(self):
+        class PidChannel(Channel):
+            def Network_pid(self, data):
+                self.Send({"action": "pid", "pid": os.getpid()})
+        
+        class TestEndPoint(EndPoint):
+            pid = None
+            def Network_pid(self, data):
+                self.pid = data["pid"]
+        
+        def work(handoff):
+            server = Server(channelClass=PidChannel, localaddr=None)
+            server.AddHandoff(handoff)
+            server.ServeForever()
+        
+        supervisor = Supervisor(("127.0.0.1", 31439), workers=2, group=2)
+        self.pid = os.fork()
+        if self.pid == 0:
+            try:
+                supervisor.Run(work)
+            finally:
+                os._exit(0)
+        supervisor.listener.close()
+        self.endpoints = [TestEndPoint(("127.0.0.1", 31439)) for x in range(4)]
+    
+    def runTest(self):
+        for endpoint in self.endpoints:
+            # connect one at a time so they are handed over in order
+            endpoint.DoConnect()
+            endpoint.Send({"action": "pid"})
+            for x in range(1000):
+                endpoint.Pump()
+                if endpoint.pid:
+                    break
+                sleep(0.001)
+        pids = [endpoint.pid for endpoint in self.endpoints]
+        self.assertTrue(all(pids))
+        self.assertEqual(pids[0], pids[1])
+        self.assertEqual(pids[2], pids[3])
+        self.assertNotEqual(pids[0], pids[2])
+        self.assertFalse(os.getpid() in pids)
+        os.kill(self.pid, signal.SIGINT)
+        self.assertEqual(os.waitpid(self.pid, 0)[1], 0)
+        # the workers have gone too
+        for pid in set(pids):
+            self.assertRaises(ProcessLookupError, os.kill, pid, 0)
+    
+    def tearDown(self):
+        [endpoint.Close() for endpoint in self.endpoints]
+        del self.endpoints
+
+class SupervisorWorkerErrorTestCase(unittest.TestCase):
+    """ A worker that raises prints the traceback and exits with a failure status. """
+    def setUp(self):
+        self.supervisor = Supervisor(("127.0.0.1", 31450), workers=1)
+        self.stderr = tempfile.TemporaryFile("w+")
+    
+    def runTest(self):
+        def work(handoff):
+            raise RuntimeError("worker broke")
+        
+        # the worker reports to stderr as it was when forked, so point it at a file meanwhile
+        saved, sys.stderr = sys.stderr, self.stderr
+        try:
+            self.supervisor._Fork(work)
+        finally:
+            sys.stderr = saved
+        pid = self.supervisor._workers[0][0]
+        status = os.waitpid(pid, 0)[1]
+        self.assertTrue(os.WIFEXITED(status))
+        self.assertEqual(os.WEXITSTATUS(status), 1)
+        self.stderr.seek(0)
+        output = self.stderr.read()
+        self.assertIn("Traceback", output)
+        self.assertIn("RuntimeError: worker broke", output)
+    
+    def tearDown(self):
+        self.supervisor.Close()
+        self.stderr.close()
+
+class AioTestCase(unittest.TestCase):
+    """ The asyncio server talks to both kinds of endpoint. """
+    def setUp(self):
+        class EchoChannel(aio.Channel):
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "n": data["n"]})
+        
+        class TestEndPoint(aio.EndPoint):
+            def Network_gotit(self, data):
+                self.received.append(data["n"])
+        
+        class OldEndPoint(EndPoint):
+            def Network_gotit(self, data):
+                self.received.append(data["n"])
+        
+        self.server = aio.Server(channelClass=EchoChannel, localaddr=("127.0.0.1", 31435))
+        self.endpoints = [TestEndPoint(("127.0.0.1", 31435)), OldEndPoint(("127.0.0.1", 31435))]
+    
+    def runTest(self):
+        for endpoint in self.endpoints:
+            endpoint.received = []
+            endpoint.DoConnect()
+            for n in range(5):
+                endpoint.Send({"action": "hello", "n": n})
+        for x in range(100):
+            self.server.Pump()
+            [endpoint.Pump() for endpoint in self.endpoints]
+            if all(len(endpoint.received) == 5 for endpoint in self.endpoints):
+                break
+            sleep(0.001)
+        for endpoint in self.endpoints:
+            self.assertEqual(endpoint.received, list(range(5)))
+            self.assertEqual(endpoint._iframing, "length")
+        self.assertEqual(len(self.server.channels), 2)
+        self.endpoints[0].Close()
+        for x in range(100):
+            self.server.Pump()
+            if not all(c.connected for c in self.server.channels):
+                break
+            sleep(0.001)
+        self.assertEqual([c.connected for c in self.server.channels].count(True), 1)
+    
+    def tearDown(self):
+        [endpoint.Close() for endpoint in self.endpoints]
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+class AioErrorTestCase(unittest.TestCase):
+    """ An asyncio channel which receives a bad message is closed, and its Close called once. """
+    def setUp(self):
+        class ClosingChannel(aio.Channel):
+            maxmessagesize = 1000
+            def Close(self):
+                self._server.closed.append(self)
+        
+        self.server = aio.Server(channelClass=ClosingChannel, localaddr=("127.0.0.1", 31447))
+        self.server.closed = []
+        self.client = None
+    
+    def runTest(self):
+        self.client = socket.create_connection(("127.0.0.1", 31447))
+        # longer than the largest message, without a terminator
+        self.client.sendall(b"x" * 100000)
+        for x in range(100):
+            self.server.Pump(0.01)
+            if self.server.closed:
+                break
+        for x in range(10):
+            self.server.Pump(0.01)
+        self.assertEqual(len(self.server.closed), 1)
+        self.assertFalse(self.server.closed[0].connected)
+    
+    def tearDown(self):
+        self.client.close()
+        self.server.close()
+        del self.server
+
+class AioServeTestCase(unittest.TestCase):
+    """ An asyncio server left running on its loop answers without being pumped. """
+    def setUp(self):
+        class EchoChannel(aio.Channel):
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "n": data["n"]})
+        
+        class TestEndPoint(aio.EndPoint):
+            received = []
+            def Network_gotit(self, data):
+                self.received.append(data["n"])
+        
+        self.server = aio.Server(channelClass=EchoChannel, localaddr=("127.0.0.1", 31436))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31436))
+        self.thread = threading.Thread(target=self.server.loop.run_forever)
+        self.thread.start()
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        self.endpoint.Send({"action": "hello", "n": 1})
+        for x in range(1000):
+            self.endpoint.Pump()
+            if self.endpoint.received:
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, [1])
+    
+    def tearDown(self):
+        self.endpoint.Close()
+        self.server.loop.call_soon_threadsafe(self.server.loop.stop)
+        self.thread.join()
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class LegacyFramingTestCase(unittest.TestCase):
+    """ A peer which offers no framings keeps both ends on the endchars terminator. """
+    def setUp(self):
+        class LegacyChannel(Channel):
+            framings = ()
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "data": data["data"]})
+        
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network_gotit(self, data):
+                self.received.append(data["data"])
+        
+        self.server = Server(channelClass=LegacyChannel, localaddr=("127.0.0.1", 31428))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31428))
+    
+    def runTest(self):
+        self.endpoint.DoConnect()
+        self.endpoint.Send({"action": "hello", "data": "old school"})
+        for x in range(50):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if self.endpoint.received:
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, ["old school"])
+        self.assertEqual(self.endpoint._oframing, "terminator")
+        self.assertEqual(self.server.channels[0]._oframing, "terminator")
+        self.endpoint.Close()
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class SymbolsTestCase(unittest.TestCase):
+    """ Clients which accept the server's symbols exchange them as short codes, the others still get plain strings. """
+    def setUp(self):
+        class SymbolChannel(Channel):
+            symbols = ("action", "hello", "greeting", "text")
+            def Network_hello(self, data):
+                self._server.received.append(data["text"])
+        
+        class TestEndPoint(EndPoint):
+            def Network_greeting(self, data):
+                self.received = data["text"]
+        
+        class PlainEndPoint(TestEndPoint):
+            def _ChooseFraming(self, data):
+                EndPoint._ChooseFraming(self, dict(data, symbols=None))
+        
+        self.server = Server(channelClass=SymbolChannel, localaddr=("127.0.0.1", 31440))
+        self.server.received = []
+        self.endpoints = [TestEndPoint(("127.0.0.1", 31440)), PlainEndPoint(("127.0.0.1", 31440))]
+    
+    def runTest(self):
+        for e in self.endpoints:
+            e.received = None
+            e.DoConnect()
+            e.Send({"action": "hello", "text": e.__class__.__name__})
+        for x in range(100):
+            self.server.Pump()
+            [e.Pump() for e in self.endpoints]
+            if len(self.server.received) == 2:
+                break
+            sleep(0.001)
+        self.assertEqual(sorted(self.server.received), ["PlainEndPoint", "TestEndPoint"])
+        self.assertEqual([e.symbolic for e in self.endpoints], [True, False])
+        self.assertEqual(sorted(c.symbolic for c in self.server.channels), [False, True])
+        # a broadcast is encoded both ways, the symbol coded message being shorter
+        symbolic = [c for c in self.server.channels if c.symbolic]
+        self.assertTrue(self.server.Broadcast({"action": "greeting", "text": "hi"}, symbolic) < len(dumps({"action": "greeting", "text": "hi"})))
+        self.server.Broadcast({"action": "greeting", "text": "hi"})
+        for x in range(100):
+            self.server.Pump()
+            [e.Pump() for e in self.endpoints]
+            if all(e.received for e in self.endpoints):
+                break
+            sleep(0.001)
+        self.assertEqual([e.received for e in self.endpoints], ["hi", "hi"])
+        [e.Close() for e in self.endpoints]
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+class CompressTestCase(unittest.TestCase):
+    """ Large messages are compressed both ways once the client accepts the server's offer. """
+    def setUp(self):
+        class CompressChannel(Channel):
+            compress = True
+            compressthreshold = 64
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "data": data["data"]})
+                self.Send({"action": "small"})
+        
+        class TestEndPoint(EndPoint):
+            received = []
+            def Network_gotit(self, data):
+                self.received.append(data["data"])
+            
+            def Network_small(self, data):
+                self.received.append("small")
+        
+        self.server = Server(channelClass=CompressChannel, localaddr=("127.0.0.1", 31441))
+        self.endpoint = TestEndPoint(("127.0.0.1", 31441))
+        self.pushed = []
+        push = self.endpoint._Push
+        self.endpoint._Push = lambda data: self.pushed.append(len(data)) or push(data)
+    
+    def runTest(self):
+        message = ["the same words again and again"] * 1000
+        self.endpoint.DoConnect()
+        self.endpoint.Send({"action": "hello", "data": message})
+        self.endpoint.Send({"action": "hello", "data": message[:3]})
+        for x in range(100):
+            self.server.Pump()
+            self.endpoint.Pump()
+            if len(self.endpoint.received) == 4:
+                break
+            sleep(0.001)
+        self.assertEqual(self.endpoint.received, [message, "small", message[:3], "small"])
+        self.assertTrue(self.endpoint._compressor is not None and self.server.channels[0]._compressor is not None)
+        self.assertTrue(sum(self.pushed) < len(dumps(message)) / 10)
+        self.endpoint.Close()
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoint
+
+class DirtyTestCase(unittest.TestCase):
+    """ Pumps only visit channels with output waiting, and channels are looked up and removed by id. """
+    def setUp(self):
+        self.server = Server(localaddr=("127.0.0.1", 31442))
+        self.endpoints = [EndPoint(("127.0.0.1", 31442)) for x in range(5)]
+    
+    def runTest(self):
+        [e.DoConnect() for e in self.endpoints]
+        for x in range(100):
+            self.server.Pump()
+            [e.Pump() for e in self.endpoints]
+            if len(self.server.channels) == 5 and not self.server.dirty:
+                break
+            sleep(0.001)
+        self.assertEqual(len(self.server.channels), 5)
+        self.assertEqual(self.server.dirty, set())
+        first, second = self.server.channels[0], self.server.channels[1]
+        second.Send({"action": "hello"})
+        self.assertEqual(self.server.dirty, set([second]))
+        self.server.Pump()
+        self.assertEqual(self.server.dirty, set())
+        # the channels behave like a list of them
+        self.assertIs(self.server.channels.get(id(second)), second)
+        self.assertTrue(second in self.server.channels)
+        for c in self.server.channels:
+            self.server.channels.remove(c)
+        self.assertFalse(second in self.server.channels)
+        self.assertEqual((len(self.server.channels), list(self.server.channels)), (0, []))
+        self.assertRaises(ValueError, self.server.channels.remove, first)
+        [e.Close() for e in self.endpoints]
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+class SocketOptionsTestCase(unittest.TestCase):
+    """ Accepted sockets get the channel's options, and one poll accepts every waiting connection. """
+    def setUp(self):
+        class TunedChannel(Channel):
+            recvbuffer = 1 << 17
+            keepalive = 30
+        
+        self.server = Server(channelClass=TunedChannel, localaddr=("127.0.0.1", 31443), reuseport=True)
+        self.clients = []
+    
+    def runTest(self):
+        for x in range(10):
+            self.clients.append(socket.create_connection(("127.0.0.1", 31443)))
+        sleep(0.05)
+        self.server.Pump(0.1)
+        self.assertEqual(len(self.server.channels), 10)
+        sock = self.server.channels[0].socket
+        self.assertEqual(sock.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        self.assertTrue(sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 1 << 17)
+        if hasattr(socket, "SO_REUSEPORT"):
+            # another listener can share the port
+            other = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            other.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            other.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            other.bind(("127.0.0.1", 31443))
+            other.close()
+        # a supervisor's listener is tuned the same way
+        supervisor = Supervisor(("127.0.0.1", 31449), recvbuffer=1 << 17, keepalive=30)
+        self.assertEqual(supervisor.listener.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE), 1)
+        self.assertTrue(supervisor.listener.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF) >= 1 << 17)
+        supervisor.Close()
+    
+    def tearDown(self):
+        [c.close() for c in self.clients]
+        [c.close() for c in self.server.channels]
+        self.server.close()
+        del self.server
+
+class LoopbackTestCase(unittest.TestCase):
+    """ A client in the server's process talks to it through memory, serialized or not. """
+    def setUp(self):
+        class EchoChannel(Channel):
+            closed = False
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "data": data["data"]})
+            
+            def Close(self):
+                self.closed = True
+        
+        self.server = Server(channelClass=EchoChannel, localaddr=None)
+        self.endpoints = [LoopbackEndPoint(self.server), LoopbackEndPoint(self.server)]
+        self.endpoints[1].serialize = False
+    
+    def runTest(self):
+        data = {"list": [1, 2, 3]}
+        for e in self.endpoints:
+            e.DoConnect()
+            e.Send({"action": "hello", "data": data})
+        self.server.Pump()
+        for e in self.endpoints:
+            e.Pump()
+            self.assertEqual([d["action"] for d in e.queue], ["socketConnect", "connected", "gotit"])
+            self.assertEqual(e.queue[-1]["data"], data)
+            self.assertTrue(e.isConnected)
+        # without serialization the very same objects are handed over
+        self.assertIsNot(self.endpoints[0].queue[-1]["data"], data)
+        self.assertIs(self.endpoints[1].queue[-1]["data"], data)
+        # hanging up is noticed by the other side on its next pump, and isn't handed back to the side that hung up
+        self.endpoints[0].close()
+        self.server.Pump()
+        self.assertEqual([c.closed for c in self.server.channels], [True, False])
+        self.endpoints[0].Pump()
+        self.assertEqual(self.endpoints[0].queue, [])
+        self.server.channels[1].close()
+        self.endpoints[1].Pump()
+        self.assertEqual([d["action"] for d in self.endpoints[1].queue], ["disconnected"])
+        self.assertFalse(self.endpoints[1].isConnected)
+        self.server.Pump()
+        self.assertEqual([c.closed for c in self.server.channels], [True, False])
+    
+    def tearDown(self):
+        self.server.close()
+        del self.server
+        del self.endpoints
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs Unix domain sockets")
+class UnixSocketTestCase(unittest.TestCase):
+    """ A server listens on a Unix domain socket beside its TCP port, on either transport. """
+    def setUp(self):
+        class EchoChannel(Channel):
+            def Network_hello(self, data):
+                self.Send({"action": "gotit", "addr": list(self.addr)})
+        
+        class AioEchoChannel(aio.Channel):
+            Network_hello = EchoChannel.Network_hello
+        
+        self.path = "/tmp/podsixnet2-test-%d.sock" % os.getpid()
+        self.servers = [Server(channelClass=EchoChannel, localaddr=("127.0.0.1", 31444)), aio.Server(channelClass=AioEchoChannel, localaddr=("127.0.0.1", 31445))]
+        self.endpoints = []
+    
+    def runTest(self):
+        # a socket file left behind by a server which has gone is replaced, as the first server's is by the second
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(self.path)
+        stale.close()
+        # any other kind of file is left alone
+        with open(self.path + ".txt", "w") as f:
+            f.write("keep")
+        self.assertRaises(OSError, self.servers[0].AddListener, "unix:" + self.path + ".txt")
+        self.assertTrue(os.path.isfile(self.path + ".txt"))
+        os.unlink(self.path + ".txt")
+        for server, endpointClass, port in zip(list(self.servers), (EndPoint, aio.EndPoint), (31444, 31445)):
+            server.AddListener("unix:" + self.path)
+            endpoints = [endpointClass(("127.0.0.1", port)), endpointClass("unix:" + self.path), endpointClass("unix:" + self.path)]
+            self.endpoints += endpoints
+            for e in endpoints:
+                e.DoConnect()
+                e.Send({"action": "hello"})
+            for x in range(100):
+                server.Pump()
+                [e.Pump() for e in endpoints]
+                if all(e.queue and e.queue[-1]["action"] == "gotit" for e in endpoints):
+                    break
+                sleep(0.001)
+            addrs = [tuple(e.queue[-1]["addr"]) for e in endpoints]
+            self.assertEqual(addrs[0][0], "127.0.0.1")
+            # clients of the Unix domain socket are numbered
+            self.assertEqual(sorted(addrs[1:]), [("unix:" + self.path, 1), ("unix:" + self.path, 2)])
+            [e.close() for e in endpoints]
+            self.servers.remove(server)
+            server.close()
+    
+    def tearDown(self):
+        [s.close() for s in self.servers]
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        del self.servers
+        del self.endpoints
+
 class ServerTestCase(unittest.TestCase):
     testdata = {"action": "hello", "data": {"a": 321, "b": [2, 3, 4], "c": ["afw", "wafF", "aa", "weEEW", "w234r"], "d": ["x"] * 256}}
     def setUp(self):
@@ -151,7 +1104,7 @@ class ServerTestCase(unittest.TestCase):
         sender.create_socket(socket.AF_INET, socket.SOCK_STREAM)
         sender.connect(("127.0.0.1", 31427))
         self.outgoing = EndPointChannel(sender, map=self.server._map)
-        
+    
     def runTest(self):
         from time import sleep
         print("*** polling for half a second")
@@ -171,6 +1124,51 @@ class ServerTestCase(unittest.TestCase):
         del self.outgoing
 
 
+class DispatchTestCase(unittest.TestCase):
+    def setUp(self):
+        
+        class Listener(object):
+            def __init__(self):
+                self.calls = []
+            
+            def Network_hello(self, data):
+                self.calls.append(("hello", data["action"]))
+            
+            @handles("chat", "say")
+            def Talk(self, data):
+                self.calls.append(("talk", data["action"]))
+            
+            def Network(self, data):
+                self.calls.append(("any", data["action"]))
+            
+            def UnknownAction(self, data):
+                self.calls.append(("unknown", data["action"]))
+        
+        class LoudListener(Listener):
+            @handles("hello")
+            def Shout(self, data):
+                self.calls.append(("shout", data["action"]))
+        
+        self.listener = Listener()
+        self.loud = LoudListener()
+        self.channel = Channel()
+    
+    def runTest(self):
+        for action in ("hello", "chat", "say", "bye"):
+            Dispatch(self.listener, {"action": action})
+        self.assertEqual(self.listener.calls, [("hello", "hello"), ("any", "hello"), ("talk", "chat"), ("any", "chat"),
+            ("talk", "say"), ("any", "say"), ("any", "bye"), ("unknown", "bye")])
+        # registrations are inherited, and several handlers of one action all run
+        Dispatch(self.loud, {"action": "hello"})
+        self.assertEqual(sorted(self.loud.calls[:2]), [("hello", "hello"), ("shout", "hello")])
+        self.assertEqual(self.loud.calls[2:], [("any", "hello")])
+        # channels dispatch through their class's table, and ignore actions they don't handle
+        self.channel._Receive(memoryview(dumps({"action": "hello"})))
+        self.channel._Receive(memoryview(dumps({"action": "nothing"})))
+    
+    def tearDown(self):
+        self.channel.close()
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -2,6 +2,7 @@
 
 # Standard library imports.
 from enum import Enum, auto
+import queue
 
 # Third party library imports.
 import pygame as pg
@@ -18,7 +19,7 @@ except ImportError:
 from config import *
 from assets import *
 
-from server import PieServer
+from server import PieServer, HostedServer
 from client import PieClient
 
 
@@ -93,8 +94,8 @@ class BaseScene:
         """Remember the screen_rect for future updates."""
         self.screen_rect = screen_rect
 
-    def pump(self):
-        """Pump network classes in the scene."""
+    def pump(self, timeout=0.0):
+        """Pump network classes in the scene, waiting up to timeout seconds for network activity."""
 
     def events(self, events):
         """Handle pygame events."""
@@ -376,7 +377,15 @@ class GameScene(BaseScene):
         # Create the server.
         self.server = None
         if server:
-            self.server = PieServer((DEFAULT_HOST, DEFAULT_PORT), players)
+            if HOSTED_SERVER != "inline":
+                # Run the server on its own, so a slow frame doesn't hold up the other players.
+                try:
+                    self.server = HostedServer((DEFAULT_HOST, DEFAULT_PORT), players, HOSTED_SERVER == "process")
+                except OSError as e:
+                    print(f"WARNING: Hosted server failed to start ({e}), pumping it between frames instead.")
+            if not self.server:
+                # Pump the server between frames, posting its status to a queue like a hosted server.
+                self.server = PieServer((DEFAULT_HOST, DEFAULT_PORT), players, status=queue.Queue())
             # Make the server public.
             self.tunnel = None
             if public:
@@ -392,7 +401,8 @@ class GameScene(BaseScene):
         else:
             address = join_address.rsplit(':')
             address = address[0], int(address[1])
-        self.client = PieClient(self, address)
+        # A hosting player's client talks to their own server directly, if it is pumped between frames.
+        self.client = PieClient(self, address, server=self.server if isinstance(self.server, PieServer) else None)
 
         # The scene variables.
         # Whether or not it is this player's turn.
@@ -409,6 +419,7 @@ class GameScene(BaseScene):
                 text = f"{self.tunnel.public_url.removeprefix('tcp://')}"
             else:
                 text = f"{self.server.get_address()}"
+        self.server_address = text
         self.address_text = Widget(DEFAULT_FONT.render(f"Server: {text}", True, BLACK, GRAY))
         # Create the client status box.
         self.client_status = Widget(DEFAULT_FONT.render("No server", True, BLACK, GRAY))
@@ -428,6 +439,21 @@ class GameScene(BaseScene):
         self.client_status.rect.midtop = self.address_text.rect.midbottom
         self.deck_status.rect.midtop = self.client_status.rect.midbottom
 
+    def update_server_status(self):
+        """Takes the status updates the hosted server has posted.
+        Updates the server address bar with the latest."""
+        status = None
+        while True:
+            try:
+                status = self.server.status.get_nowait()
+            except queue.Empty:
+                break
+        if status:
+            self.address_text = Widget(DEFAULT_FONT.render(
+                f"Server: {self.server_address} - {status['players']} players, {status['tables']} tables playing",
+                True, BLACK, GRAY))
+            self.position_widgets()
+
     def update_client_status(self, status):
         """Called from the PieClient on certain Network events.
         Updates the client status bar."""
@@ -482,10 +508,15 @@ class GameScene(BaseScene):
         self.screen_rect = screen_rect
         self.position_widgets()
 
-    def pump(self):
+    def pump(self, timeout=0.0):
         if self.server:
-            self.server.pump()
-        self.client.pump()
+            self.update_server_status()
+        if isinstance(self.server, PieServer):
+            # The server pumped between frames does the waiting, since any activity reaches it first.
+            self.server.pump(timeout)
+            self.client.pump()
+        else:
+            self.client.pump(timeout)
 
     def events(self, events):
         for event in events:
@@ -1,27 +1,74 @@
-"""The server side for Go Pie."""
+"""The server side for Go Pie.
+
+Run it directly with `python -m server` to host a dedicated server without a display.
+"""
+
+# Standard library imports.
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
 
 # Third party library imports.
-from podsixnet2.Channel import Channel
-from podsixnet2.Server import Server
+try:
+    from podsixnet2.Channel import Channel
+    from podsixnet2.Server import Server
+except ImportError:
+    # Python 3.12 and above no longer have asyncore, so use the asyncio backend.
+    from podsixnet2.aio import Channel, Server
+from podsixnet2.Supervisor import Supervisor
 
 # Local library imports.
 from config import *
 import pydeck as pd
 
+# The sizes of table a client can ask to play at.
+MIN_PLAYERS = 2
+MAX_PLAYERS = 8
+# How many hand and stats updates go by between full snapshots, which resync every client.
+SNAPSHOT_INTERVAL = 10
+
 
 class DummyPlayer:
-    """Ignore this class, but don't delete it or the PieServer.player_ask method will crash."""
+    """Ignore this class, but don't delete it or the Table.player_ask method will crash."""
     connected = False
 
 
 class ClientChannel(Channel):
     """The server representation of a client."""
+    # A slow client only needs the latest hand and stats, and can catch up on the chat log later.
+    backpressure = "pause"
+    superseded = ("hand_and_stats",)
+    # A snapshot also replaces the changes queued before it, which may have been made to an older snapshot it replaces.
+    supersedes = {"hand_and_stats": ("hand_and_stats", "hand_and_stats_delta")}
+    noncritical = ("chat",)
+    # Action names, keys and card names sent as two byte codes to clients which accept them.
+    symbols = ("action", "queue", "players", "waiting", "wait", "chat", "start_game", "hand_and_stats", "id", "hand",
+               "stats", "deck", "hand_and_stats_delta", "added", "removed", "turn", "game_over", "server_full",
+               "confirm_connect", "address", "disconnected", "shutdown", "ask", "player", "rank", "join") + tuple(
+        rank + suit for rank in pd.FRENCH_RANKS for suit in pd.FRENCH_SUITS)
+    # Deflate messages as configured, which saves players on tunnels bandwidth but is done separately for each player.
+    compress = COMPRESS
+    compressthreshold = COMPRESS_THRESHOLD
+    # Tune the client sockets as configured.
+    sendbuffer = SEND_BUFFER
+    recvbuffer = RECEIVE_BUFFER
+    keepalive = KEEPALIVE
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        # The table the client is seated at, if any.
+        self.table = None
+        # When the client joined the matchmaking queue.
+        self.queued_at = 0
         # The player id.
         self.player_id = None
         # Initialize the player info.
         self.hand = pd.Stack()
+        # The cards of the hand last sent to the client, as strings.
+        self.sent_hand = set()
         # The tricks taken as a list of ranks.
         self.tricks = []
 
@@ -31,25 +78,34 @@ class ClientChannel(Channel):
 
     def Network_ask(self, data):
         """Called when a player asks another for a card."""
-        self._server.player_ask(self, data["player"], data["rank"])
+        if self.table and self.table.playing:
+            self.table.player_ask(self, data["player"], data["rank"])
+
+    def Network_join(self, data):
+        """Called when a waiting client asks to play at a table of a different size."""
+        players = data.get("players")
+        if type(players) is int and MIN_PLAYERS <= players <= MAX_PLAYERS and not (self.table and self.table.playing):
+            self._server.queue_player(self, players)
 
     def Close(self):
         """Will be called upon client disconnection."""
         print(f"[Server] Client disconnected {self.get_address()}")
-        # Remove self from the server's client list if not a player.
-        # Removing player clients will cause problems.
-        if self not in self._server.players:
+        # Players stay at their table, which skips them once they disconnect.
+        if self.table:
+            self.table.leave(self)
+        if self in self._server.channels:
             self._server.channels.remove(self)
+        self._server.post_status()
 
 
-class PieServer(Server):
-    """The server class for Go Pie."""
-    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), players=2):
-        """Initialize the server."""
-        super().__init__(ClientChannel, address)
-        # Save the server address.
-        self.address = address
-        print(f"[Server] Server started on {self.get_address()}")
+class Table:
+    """A single game of Go Pie between its own players."""
+    def __init__(self, server, number, players=2):
+        """Initialize an empty table."""
+        # The server hosting the table.
+        self.server = server
+        # The table number, for the logs.
+        self.number = number
         # The number of players to wait for.
         self.max_clients = players
         # The list of playing clients.
@@ -60,55 +116,104 @@ class PieServer(Server):
         self.deck = pd.new_deck(shuffle=True)
         # Whether the game is playing.
         self.playing = False
+        # The hand size and number of tricks of each player last sent to the players.
+        self.sent_counts = []
+        # The number of hand and stats updates sent since the game started.
+        self.updates = 0
 
-    def get_address(self):
-        """Returns the server address as a string "host:port"."""
-        return f"{self.address[0]}:{self.address[1]}"
+    def is_full(self):
+        """Returns whether every seat at the table is taken."""
+        return len(self.players) == self.max_clients
 
-    def pump(self):
-        """Pump the network classes.
+    def seat(self, client: ClientChannel):
+        """Seat the client at the table, starting the game once it is full."""
+        self.players.append(client)
+        client.table = self
+        if self.is_full():
+            self.start_game()
+        else:
+            self.send_queue_status()
 
-        Should be called once per game loop."""
-        self.Pump()
+    def leave(self, client: ClientChannel):
+        """Called when a seated client disconnects or moves to another table."""
+        client.table = None
+        # Players can only leave their seat before the game starts, afterwards their turn is skipped.
+        if not self.playing:
+            self.players.remove(client)
+        # The client is still connected until it has finished closing.
+        if not any(player.connected for player in self.players if player is not client):
+            self.server.close_table(self)
+        elif not self.playing:
+            self.send_queue_status()
+
+    def send_queue_status(self):
+        """Tells the waiting players how many have joined and how long tables of this size usually take to fill."""
+        self.send_all({"action": "queue", "players": self.max_clients, "waiting": len(self.players),
+                       "wait": round(self.server.average_waits.get(self.max_clients, 0), 1)})
 
     def send_all(self, data):
-        """Sends the network data to all clients in channel list."""
-        [client.Send(data) for client in self.channels]
+        """Sends the network data to all connected players at the table.
 
-    def Connected(self, client, address):
-        """Accept the new client and send confirmation data."""
-        # Log the connection.
-        print(f"[Server] New connection from {client.get_address()}")
-        # Only accept a certain number of clients.
-        if len(self.channels) > self.max_clients:
-            client.Send({"action": "server_full"})
-        else:
-            # Send a confirmation that this server is valid.
-            client.Send({"action": "confirm_connect", "address": address})
-
-        # Start the game.
-        if len(self.channels) == self.max_clients:
-            # Start playing the game.
-            self.playing = True
-            self.players = list(self.channels)
-            # Deal hands and send out the start data.
-            # Does not deal with tricks in starting hands.
-            for player_id, player in enumerate(self.players):
-                player.player_id = player_id
-                player.hand = self.deck.deal(6)
-                self.update_tricks(player)
-            # Calculate the game stats.
-            stats = [(len(player.hand), player.tricks) for player in self.players]
-            # Send the start game information to all players.
-            for player in self.players:
-                player.Send({"action": "start_game",
-                             "id": self.players.index(player),
-                             "hand": [str(card) for card in player.hand],
-                             "stats": stats,
-                             "deck": len(self.deck),
-                             })
-            # Tell the first player it's their turn.
-            self.players[self.turn].Send({"action": "turn"})
+        The data is encoded once and shared by every player."""
+        self.server.Broadcast(data, [player for player in self.players if player.connected])
+
+    def send_hand_and_stats(self):
+        """Sends every player the cards added to and removed from their hand, and the stats which have changed.
+
+        Every SNAPSHOT_INTERVAL updates, and whenever a player's connection is congested, the player gets their
+        whole hand and all the stats instead, which also replaces any older snapshot and changes still queued for them."""
+        stats = [(len(player.hand), player.tricks) for player in self.players]
+        # Tricks are only ever added, so their number tells whether the list has changed.
+        counts = [(size, len(tricks)) for size, tricks in stats]
+        changed = {player_id: stat for player_id, stat in enumerate(stats)
+                   if counts[player_id] != self.sent_counts[player_id]}
+        self.sent_counts = counts
+        self.updates += 1
+        snapshots, deltas = {}, {}
+        for player in self.players:
+            if not player.connected:
+                continue
+            hand = {str(card) for card in player.hand}
+            if self.updates % SNAPSHOT_INTERVAL == 0 or player.congested:
+                snapshots[player] = {"hand": [str(card) for card in player.hand]}
+            else:
+                # Only send the card lists which aren't empty.
+                delta = {"added": list(hand - player.sent_hand), "removed": list(player.sent_hand - hand)}
+                deltas[player] = {key: cards for key, cards in delta.items() if cards}
+            player.sent_hand = hand
+        if snapshots:
+            self.server.BroadcastEach({"action": "hand_and_stats", "stats": stats, "deck": len(self.deck)}, snapshots)
+        if deltas:
+            self.server.BroadcastEach({"action": "hand_and_stats_delta", "stats": changed, "deck": len(self.deck)},
+                                      deltas)
+
+    def start_game(self):
+        """Deal hands and send out the start data."""
+        # Record how long the players waited for the table to fill.
+        wait = time.monotonic() - sum(player.queued_at for player in self.players) / len(self.players)
+        self.server.record_wait(self.max_clients, wait)
+        print(f"[Server] Table {self.number} started with {len(self.players)} players "
+              f"after waiting {wait:.1f} seconds on average.")
+        # Start playing the game.
+        self.playing = True
+        self.server.post_status()
+        # Does not deal with tricks in starting hands.
+        for player_id, player in enumerate(self.players):
+            player.player_id = player_id
+            player.hand = self.deck.deal(6)
+            self.update_tricks(player)
+            player.sent_hand = {str(card) for card in player.hand}
+        # Calculate the game stats.
+        stats = [(len(player.hand), player.tricks) for player in self.players]
+        self.sent_counts = [(size, len(tricks)) for size, tricks in stats]
+        # Send the start game information to all players.
+        # The stats and deck are encoded once, the id and hand per player.
+        self.server.BroadcastEach({"action": "start_game", "stats": stats, "deck": len(self.deck)},
+                                  {player: {"id": player.player_id,
+                                            "hand": [str(card) for card in player.hand]}
+                                   for player in self.players})
+        # Tell the first player it's their turn.
+        self.players[self.turn].Send({"action": "turn"})
 
     def update_tricks(self, player: ClientChannel):
         """Searches given player's hand for tricks and updates accordingly."""
@@ -164,13 +269,7 @@ class PieServer(Server):
                     # Continue the turn.
                     player_asking.Send({"action": "turn"})
                     # Update the players.
-                    stats = [(len(player.hand), player.tricks) for player in self.players]
-                    for player in self.players:
-                        player.Send({"action": "hand_and_stats",
-                                     "hand": [str(card) for card in player.hand],
-                                     "stats": stats,
-                                     "deck": len(self.deck),
-                                     })
+                    self.send_hand_and_stats()
                     # Leave the function early to avoid turn counter.
                     return
             else:
@@ -199,13 +298,121 @@ class PieServer(Server):
                 player.Send({"action": "turn"})
 
         # Update the players.
-        stats = [(len(player.hand), player.tricks) for player in self.players]
-        for player in self.players:
-            player.Send({"action": "hand_and_stats",
-                         "hand": [str(card) for card in player.hand],
-                         "stats": stats,
-                         "deck": len(self.deck),
-                         })
+        self.send_hand_and_stats()
+
+
+class PieServer(Server):
+    """The server class for Go Pie."""
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), players=2, tables=1, handoff=None, status=None):
+        """Initialize the server.
+
+        Clients are seated at tables of the given number of players, with at most the given number
+        of tables playing at once, or any number if tables is 0.
+        A worker under a Supervisor is given its handoff socket instead of listening on the address itself.
+        If status is given, a queue, the number of players and tables is put on it whenever they change."""
+        super().__init__(ClientChannel, None if handoff else address, LISTEN_BACKLOG, REUSE_PORT)
+        # The queue to post status updates to, if any.
+        self.status = status
+        # Save the server address.
+        self.address = address
+        if handoff:
+            self.AddHandoff(handoff)
+            print(f"[Server] Worker {os.getpid()} started on {self.get_address()}")
+        else:
+            print(f"[Server] Server started on {self.get_address()}")
+        # The number of players at each table, unless a client asks for another size.
+        self.max_clients = players
+        # The most tables to host at once.
+        self.max_tables = tables
+        # The tables being played or waiting for players.
+        self.tables = []
+        # The matchmaking queue, the table filling up for each number of players.
+        self.open_tables = {}
+        # The moving average wait for a table to fill in seconds, for each number of players.
+        self.average_waits = {}
+        # The number given to the next table.
+        self.table_number = 0
+        self.post_status()
+
+    def get_address(self):
+        """Returns the server address as a string "host:port"."""
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def pump(self, timeout=0.0):
+        """Pump the network classes, waiting up to timeout seconds for network activity.
+
+        Should be called once per game loop."""
+        self.Pump(timeout)
+
+    def post_status(self):
+        """Puts the number of players connected and tables playing on the status queue, if there is one."""
+        if self.status is not None:
+            self.status.put({"players": len(self.channels), "tables": sum(table.playing for table in self.tables)})
+
+    def send_all(self, data):
+        """Sends the network data to all clients in channel list, at every table.
+
+        The data is encoded once and shared by every client."""
+        self.Broadcast(data)
+
+    def Connected(self, client, address):
+        """Queue the new client for a table and send confirmation data."""
+        # Log the connection.
+        print(f"[Server] New connection from {client.get_address()}")
+        self.post_status()
+        # Only accept a certain number of clients.
+        if self.max_clients not in self.open_tables and self.max_tables and len(self.tables) >= self.max_tables:
+            client.Send({"action": "server_full"})
+            return
+        # Send a confirmation that this server is valid.
+        client.Send({"action": "confirm_connect", "address": address})
+        self.queue_player(client, self.max_clients)
+
+    def queue_player(self, client: ClientChannel, players: int):
+        """Seat the client at the table filling up for the number of players, opening one if there is none."""
+        # Leave any table the client is already waiting at.
+        if client.table:
+            client.table.leave(client)
+        if not (table := self.open_tables.get(players)):
+            if self.max_tables and len(self.tables) >= self.max_tables:
+                client.Send({"action": "server_full"})
+                return
+            self.table_number += 1
+            table = self.open_tables[players] = Table(self, self.table_number, players)
+            self.tables.append(table)
+        client.queued_at = time.monotonic()
+        table.seat(client)
+        if table.playing:
+            # The table is full and has started.
+            del self.open_tables[players]
+
+    def record_wait(self, players: int, wait: float):
+        """Adds the average wait of a table that has just filled to the moving average for its size."""
+        average = self.average_waits.get(players)
+        self.average_waits[players] = wait if average is None else average * 0.8 + wait * 0.2
+
+    def queue_stats(self):
+        """Returns the players waiting and the moving average wait in seconds for each table size."""
+        return {players: (len(self.open_tables[players].players) if players in self.open_tables else 0,
+                          self.average_waits.get(players, 0))
+                for players in self.open_tables.keys() | self.average_waits.keys()}
+
+    def report_queue(self, interval=60):
+        """Logs the matchmaking queue now and every interval seconds after."""
+        for players, (waiting, wait) in sorted(self.queue_stats().items()):
+            if waiting:
+                print(f"[Server] {waiting}/{players} players waiting, "
+                      f"tables of {players} fill in {wait:.1f} seconds on average.")
+        self.CallLater(interval, self.report_queue, interval)
+
+    def close_table(self, table: Table):
+        """Removes a table once all of its players have left."""
+        self.tables.remove(table)
+        if self.open_tables.get(table.max_clients) is table:
+            del self.open_tables[table.max_clients]
+        if table.playing:
+            print(f"[Server] Table {table.number} closed.")
+            self.post_status()
 
     def quit(self):
         """Shut down the server."""
@@ -217,3 +424,127 @@ class PieServer(Server):
         print("[Server] Shut down.")
         # Close the server.
         self.close()
+
+
+def serve(server):
+    """Run the server until interrupted."""
+    server.report_queue()
+    try:
+        # Sleep until there is network activity.
+        server.ServeForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.quit()
+
+
+def host(address, players, status, stopping, interval=0.25):
+    """Run a server for a game hosting it from another thread or process, until stopping is set.
+
+    Status updates are put on the status queue, starting with an error if the server can't start."""
+    try:
+        server = PieServer(address, players, status=status)
+    except Exception as e:
+        status.put({"error": str(e)})
+        return
+
+    def check():
+        """Stop serving once the game asks, or check again after the interval."""
+        if stopping.is_set():
+            server.Stop()
+        else:
+            server.CallLater(interval, check)
+
+    check()
+    serve(server)
+
+
+class HostedServer:
+    """A PieServer run by the game on its own thread or child process.
+
+    The server keeps serving the other players while the game is busy drawing a frame, and only
+    status updates are handed back to the game, through a queue."""
+    def __init__(self, address=(DEFAULT_HOST, DEFAULT_PORT), players=2, process=False, timeout=10.0):
+        """Start the server and wait until it is listening.
+
+        Raises OSError if the server can't listen on the address, or doesn't start within timeout seconds."""
+        # Save the server address.
+        self.address = address
+        if process:
+            self.status = multiprocessing.Queue()
+            self.stopping = multiprocessing.Event()
+            self.runner = multiprocessing.Process(target=host, args=(address, players, self.status, self.stopping),
+                                                  daemon=True)
+        else:
+            self.status = queue.Queue()
+            self.stopping = threading.Event()
+            self.runner = threading.Thread(target=host, args=(address, players, self.status, self.stopping),
+                                           daemon=True)
+        self.runner.start()
+        # The first status tells whether the server is listening, so clients can connect once this returns.
+        if "error" in (first := self.first_status(timeout)):
+            self.runner.join()
+            raise OSError(first["error"])
+
+    def first_status(self, timeout):
+        """Returns the first status the server posts, or an error if it dies or takes longer than timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            alive = self.runner.is_alive()
+            try:
+                return self.status.get(timeout=0.1)
+            except queue.Empty:
+                # Anything posted before the runner ended has arrived by now.
+                if not alive:
+                    return {"error": "the server stopped before it started"}
+        # Don't leave a process which hasn't started running.
+        self.stopping.set()
+        if isinstance(self.runner, multiprocessing.Process):
+            self.runner.terminate()
+        return {"error": f"the server didn't start within {timeout} seconds"}
+
+    def get_address(self):
+        """Returns the server address as a string "host:port"."""
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def quit(self, timeout=5.0):
+        """Shut down the server and wait up to timeout seconds for it to finish."""
+        self.stopping.set()
+        self.runner.join(timeout)
+
+
+def main(argv=None):
+    """Run a dedicated server until interrupted."""
+    parser = argparse.ArgumentParser(prog="python -m server", description="Host a Go Pie server without a display.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"the address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"the port to listen on (default {DEFAULT_PORT})")
+    parser.add_argument("--players", type=int, default=DEFAULT_PLAYERS, choices=range(2, 9), metavar="{2..8}",
+                        help=f"the number of players at each table (default {DEFAULT_PLAYERS})")
+    parser.add_argument("--tables", type=int, default=0,
+                        help="the most tables to host at once, 0 for no limit (default 0)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="the number of worker processes to spread the tables over (default 1)")
+    parser.add_argument("--unix", metavar="PATH",
+                        help="also listen on a Unix domain socket at PATH, for bots and tools on this machine")
+    args = parser.parse_args(argv)
+    if args.unix and args.workers > 1:
+        parser.error("--unix can't be used with more than one worker")
+    address = (args.host, args.port)
+    if args.workers > 1:
+        # Hand consecutive players to the same worker in groups of the default table size, which keeps the players of a
+        # default-size table together on a best effort basis only, and split any table limit between the workers.
+        tables = -(-args.tables // args.workers)
+        supervisor = Supervisor(address, args.workers, args.players, LISTEN_BACKLOG, REUSE_PORT,
+                                SEND_BUFFER, RECEIVE_BUFFER, KEEPALIVE)
+        print(f"[Server] Supervisor started on {args.host}:{args.port} with {args.workers} workers")
+        supervisor.Run(lambda handoff: serve(PieServer(address, args.players, tables, handoff)))
+    else:
+        server = PieServer(address, args.players, args.tables)
+        if args.unix:
+            server.AddListener("unix:" + args.unix)
+            print(f"[Server] Also listening on {args.unix}")
+        serve(server)
+
+
+if __name__ == "__main__":
+    main()